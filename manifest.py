@@ -0,0 +1,210 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import sys
+
+# Note: columns are hashed in blocks of this many, per partition (e.g. per Year)
+BLOCK_SIZE = 8
+PARTITION = "Year"
+
+# Note: floats are compared at this many significant digits, since pandas' default CSV float parser can be off
+# by thousands of units in the last place (e.g. 27.704352287868375 is read back as 27.70435228786837), so frames
+# read back that way almost always hash alike too; read_output parses exactly (float_precision="round_trip"),
+# so in-memory frames and their CSVs read through it always agree
+SIGNIFICANT_DIGITS = 10
+
+# Function to round finite non-zero floats to SIGNIFICANT_DIGITS significant digits (and -0.0 to 0.0)
+def _canonical(v):
+    with np.errstate(all="ignore"):
+        finite = np.isfinite(v) & (v != 0)
+        exponent = np.floor(np.log10(np.abs(np.where(finite, v, 1.0))))
+        scale = 10.0 ** (SIGNIFICANT_DIGITS - 1 - exponent)
+        rounded = np.round(v * scale) / scale
+        return np.where(finite & np.isfinite(scale) & np.isfinite(rounded), rounded, v) + 0.0
+
+# Function to normalise a column so in-memory frames and their CSV round trips hash alike
+# Note: numeric columns compare as float64 rounded to SIGNIFICANT_DIGITS (ints and floats match), everything
+# else as strings with NaN kept missing
+def _normalise(s):
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return _canonical(s.astype(np.float64).values)
+    return s.astype(object).where(s.notna(), None).map(lambda v: v if v is None else str(v)).values
+
+# Function to hash every value of a frame column-wise, returning a rows x columns uint64 array
+def cell_hashes(df):
+    out = np.empty((len(df), len(df.columns)), dtype=np.uint64)
+    for i, c in enumerate(df.columns):
+        out[:, i] = pd.util.hash_array(_normalise(df[c]), categorize=False)
+    return out
+
+# Function to combine the cell hashes of each row of a block into one order-sensitive row hash
+def _row_hashes(cells):
+    h = np.zeros(len(cells), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i in range(cells.shape[1]):
+            h = h * np.uint64(1000003) ^ cells[:, i]
+    return h
+
+# Function to hash a set of rows independently of row order (wrapping sum of row hashes, plus the row count)
+def _digest(row_hashes):
+    with np.errstate(over="ignore"):
+        return f"{len(row_hashes)}:{int(row_hashes.sum(dtype=np.uint64)):016x}"
+
+# Function to format a partition value so e.g. 2006 and 2006.0 label the same partition
+def _label(v):
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return "NA"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+# Function to map each row to its partition label (a single "all" partition when the column is absent)
+def _partitions(df, partition):
+    if partition is None or partition not in df.columns:
+        return np.full(len(df), "all", dtype=object)
+    codes, uniques = pd.factorize(_normalise(df[partition]), use_na_sentinel=False)
+    return np.array([_label(v) for v in uniques], dtype=object)[codes]
+
+# Function to build a manifest of per-partition, per-column-block content hashes for a frame
+def build_manifest(df, partition=PARTITION, block_size=BLOCK_SIZE):
+    columns = [str(c) for c in df.columns]
+    blocks = [columns[i:i + block_size] for i in range(0, len(columns), block_size)]
+    cells = cell_hashes(df)
+    labels = _partitions(df, partition)
+    codes, uniques = pd.factorize(labels)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    partitions = {}
+    for i, label in enumerate(uniques):
+        rows = order[bounds[i]:bounds[i + 1]]
+        partitions[label] = [_digest(_row_hashes(cells[rows][:, b * block_size:(b + 1) * block_size])) for b in range(len(blocks))]
+    return {
+        "rows": len(df),
+        "partition": partition if partition in df.columns else None,
+        "block_size": block_size,
+        "columns": columns,
+        "blocks": blocks,
+        "partitions": dict(sorted(partitions.items())),
+    }
+
+# Function to name the manifest written next to an output file
+def manifest_path(path):
+    root = path[:-len(".csv")] if path.endswith(".csv") else path
+    return f"{root}.manifest.json"
+
+# Function to write a frame's manifest next to its output (local path or s3:// URL)
+def write_manifest(df, path, partition=PARTITION, block_size=BLOCK_SIZE):
+    manifest = build_manifest(df, partition, block_size)
+    text = json.dumps(manifest, indent=1)
+    if path.startswith("s3://"):
+        import fsspec
+        with fsspec.open(manifest_path(path), "w") as f:
+            f.write(text)
+    else:
+        with open(manifest_path(path), "w") as f:
+            f.write(text)
+    return manifest
+
+# Function to read a manifest (local path or s3:// URL)
+def read_manifest(path):
+    if path.startswith("s3://"):
+        import fsspec
+        with fsspec.open(path, "r") as f:
+            return json.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+# Function to compare two manifests, listing schema differences and mismatched (partition, column block) pairs
+def compare(a, b):
+    diff = {"columns_only_a": [c for c in a["columns"] if c not in b["columns"]], "columns_only_b": [c for c in b["columns"] if c not in a["columns"]], "mismatches": []}
+    if a["blocks"] != b["blocks"] or a["partition"] != b["partition"]:
+        diff["mismatches"] = [(p, None) for p in sorted(set(a["partitions"]) | set(b["partitions"]))]
+        return diff
+    for p in sorted(set(a["partitions"]) | set(b["partitions"])):
+        ha, hb = a["partitions"].get(p), b["partitions"].get(p)
+        if ha is None or hb is None:
+            diff["mismatches"].append((p, None))
+            continue
+        diff["mismatches"].extend((p, i) for i, (x, y) in enumerate(zip(ha, hb)) if x != y)
+    return diff
+
+# Function to find the exact rows and columns behind mismatched partitions/blocks of two frames
+# Note: with keys, rows are aligned on the key columns and differing cells are listed; without keys, rows present
+# in only one frame (as whole-row multisets) are listed
+def drill_down(df_a, df_b, mismatches, partition=PARTITION, block_size=BLOCK_SIZE, keys=None):
+    columns = [c for c in df_a.columns if c in df_b.columns]
+    parts = sorted(set(p for p, _ in mismatches))
+    df_a = df_a[np.isin(_partitions(df_a, partition), parts)][columns].reset_index(drop=True)
+    df_b = df_b[np.isin(_partitions(df_b, partition), parts)][columns].reset_index(drop=True)
+    if any(block is None for _, block in mismatches):
+        check = columns
+    else:
+        check = sorted(set(c for _, block in mismatches for c in columns[block * block_size:(block + 1) * block_size]), key=columns.index)
+
+    if keys:
+        merged = pd.merge(df_a, df_b, how="outer", on=keys, suffixes=("_a", "_b"), indicator=True)
+        cells = []
+        for c in check:
+            if c in keys:
+                continue
+            a, b = merged[f"{c}_a"], merged[f"{c}_b"]
+            changed = (pd.util.hash_array(_normalise(a), categorize=False) != pd.util.hash_array(_normalise(b), categorize=False))
+            for i in np.flatnonzero(changed):
+                cells.append({**{k: merged[k].iat[i] for k in keys}, "Column": c, "A": a.iat[i], "B": b.iat[i]})
+        return pd.DataFrame(cells)
+
+    ha = _row_hashes(cell_hashes(df_a[check]))
+    hb = _row_hashes(cell_hashes(df_b[check]))
+    ca, cb = pd.Series(ha).value_counts(), pd.Series(hb).value_counts()
+    extra_a = ca.sub(cb, fill_value=0)
+    extra_b = cb.sub(ca, fill_value=0)
+    only_a = df_a[pd.Series(ha).map(extra_a).values > 0].assign(Side="A")
+    only_b = df_b[pd.Series(hb).map(extra_b).values > 0].assign(Side="B")
+    return pd.concat([only_a, only_b], ignore_index=True)
+
+# Function to read an output that may be split into chunk files (e.g. out/data_chunk_0.csv ... out/data_chunk_5.csv)
+def read_output(paths):
+    return pd.concat([pd.read_csv(p, low_memory=False, float_precision="round_trip") for p in paths], ignore_index=True)
+
+# Command line entry point, e.g. `python manifest.py write out/data-flat-by-precinct-year.csv` or
+# `python manifest.py diff old/data.manifest.json out/data.manifest.json --a-csv old/data_chunk_*.csv --b-csv out/data_chunk_*.csv`
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="manifest", description="Write and compare content-hash manifests of pipeline outputs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    write = commands.add_parser("write", help="write a manifest next to an output (chunk files are combined)")
+    write.add_argument("paths", nargs="+", help="output CSV file(s)")
+    write.add_argument("--output", help="output path the manifest is named after (default: the first path)")
+    write.add_argument("--partition", default=PARTITION, help=f"partition column (default {PARTITION}; ignored if absent)")
+    diff = commands.add_parser("diff", help="compare two manifests")
+    diff.add_argument("a")
+    diff.add_argument("b")
+    diff.add_argument("--a-csv", nargs="+", help="output file(s) behind manifest A, loaded only on mismatch to list the differing rows")
+    diff.add_argument("--b-csv", nargs="+", help="output file(s) behind manifest B")
+    diff.add_argument("--keys", help="comma-separated key columns to align rows on when drilling down, e.g. Year,Precinct")
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        write_manifest(read_output(args.paths), args.output or args.paths[0], args.partition)
+        print(f"Wrote {manifest_path(args.output or args.paths[0])}")
+        return
+
+    a, b = read_manifest(args.a), read_manifest(args.b)
+    result = compare(a, b)
+    if result["columns_only_a"] or result["columns_only_b"]:
+        print(f"Columns only in A: {result['columns_only_a']}; only in B: {result['columns_only_b']}")
+    if a["rows"] != b["rows"]:
+        print(f"Rows: {a['rows']} in A, {b['rows']} in B")
+    if not result["mismatches"] and a["columns"] == b["columns"]:
+        print("Outputs match")
+        return
+    for p, block in result["mismatches"]:
+        print(f"Mismatch in {a['partition'] or 'partition'} {p}: " + ("all columns" if block is None else ", ".join(a["blocks"][block])))
+    if args.a_csv and args.b_csv and result["mismatches"]:
+        keys = args.keys.split(",") if args.keys else None
+        df_a, df_b = read_output(args.a_csv), read_output(args.b_csv)
+        print(drill_down(df_a, df_b, result["mismatches"], a["partition"], a["block_size"], keys).to_string())
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
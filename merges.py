@@ -0,0 +1,72 @@
+from pandas.errors import MergeError
+import pandas as pd
+import numpy as np
+
+# Note: max_growth caps a merge result at this multiple of its larger input before anything is materialised
+MAX_GROWTH = 1.0
+
+# Function to normalise merge key arguments to matching left/right column lists
+def _merge_keys(on, left_on, right_on):
+    if on is not None:
+        left_on = right_on = on
+    left_on = [left_on] if isinstance(left_on, str) else list(left_on)
+    right_on = [right_on] if isinstance(right_on, str) else list(right_on)
+    if len(left_on) != len(right_on):
+        raise MergeError(f"len(left_on)={len(left_on)} must equal len(right_on)={len(right_on)}")
+    return left_on, right_on
+
+# Function to integer-code composite join keys on both sides with one shared factorization per column
+# Note: NaN keys get their own code, matching pandas' behaviour of joining NaN to NaN
+def key_codes(left, right, left_on, right_on):
+    n_left = len(left)
+    codes = np.zeros(n_left + len(right), dtype=np.int64)
+    for lc, rc in zip(left_on, right_on):
+        col_codes, uniques = pd.factorize(pd.concat([left[lc], right[rc]], ignore_index=True), use_na_sentinel=False)
+        codes, _ = pd.factorize(codes * (len(uniques) + 1) + col_codes)
+    return codes[:n_left], codes[n_left:]
+
+# Function to count the rows a merge would produce from the key codes of each side
+def predicted_rows(left_codes, right_codes, how):
+    n_keys = max(left_codes.max(initial=-1), right_codes.max(initial=-1)) + 1
+    left_matches = np.bincount(right_codes, minlength=n_keys)[left_codes]
+    right_matches = np.bincount(left_codes, minlength=n_keys)[right_codes]
+    rows = int(left_matches.sum())
+    if how in ("left", "outer"):
+        rows += int((left_matches == 0).sum())
+    if how in ("right", "outer"):
+        rows += int((right_matches == 0).sum())
+    return rows
+
+# Function to merge two frames after checking declared key cardinality and the size of the result
+# Note: validate follows pandas ("1:1", "1:m", "m:1", "m:m"); raises MergeError before merging on violation
+def guarded_merge(left, right, how="inner", on=None, left_on=None, right_on=None, validate="m:1", max_growth=MAX_GROWTH, name=None, **kwargs):
+    left_keys, right_keys = _merge_keys(on, left_on, right_on)
+    left_codes, right_codes = key_codes(left, right, left_keys, right_keys)
+    name = name or f"merge on {left_keys}"
+
+    if validate in ("1:1", "1:m") and pd.Series(left_codes).duplicated().any():
+        raise MergeError(f"{name}: left keys {left_keys} are not unique, declared {validate}")
+    if validate in ("1:1", "m:1") and pd.Series(right_codes).duplicated().any():
+        raise MergeError(f"{name}: right keys {right_keys} are not unique, declared {validate}")
+
+    rows = predicted_rows(left_codes, right_codes, how)
+    limit = max_growth * max(len(left), len(right))
+    if rows > limit:
+        raise MergeError(f"{name}: result would have {rows} rows, over the limit of {int(limit)} ({len(left)} left, {len(right)} right)")
+    if rows != len(left):
+        print(f"{name}: {len(left)} -> {rows} rows ({rows - len(left):+d})")
+
+    if on is not None:
+        return pd.merge(left, right, how=how, on=on, **kwargs)
+    return pd.merge(left, right, how=how, left_on=left_on, right_on=right_on, **kwargs)
+
+# Function to add a single spot-fill row unless a row with the same key already exists
+def spot_fill(df, row, on):
+    on = [on] if isinstance(on, str) else list(on)
+    if df.duplicated(subset=on).any():
+        raise MergeError(f"spot fill: keys {on} are not unique")
+    present = np.logical_and.reduce([df[k].values == row[k] for k in on])
+    if present.any():
+        print(f"spot fill: {dict((k, row[k]) for k in on)} already present, skipping")
+        return df
+    return pd.concat([df, pd.DataFrame([row])], ignore_index=True)
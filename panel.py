@@ -0,0 +1,106 @@
+import pandas as pd
+import numpy as np
+
+# Declared validity ranges per precinct as (first year, last year), None meaning open-ended
+# Note: precincts not listed (including the TD transit districts) are valid in every year;
+# Precinct 121 was not yet an official precinct before 2014
+PRECINCT_VALIDITY = {
+    "121": (2014, None),
+}
+
+GRANULARITIES = ("year", "month", "week")
+
+# Function to mask rows of a frame whose precinct-year falls outside its declared validity range
+def valid_rows(df, precinct="Precinct", year="Year", validity=PRECINCT_VALIDITY):
+    precincts = df[precinct].astype(str)
+    first = precincts.map({p: lo for p, (lo, hi) in validity.items() if lo is not None})
+    last = precincts.map({p: hi for p, (lo, hi) in validity.items() if hi is not None})
+    years = df[year]
+    return ((first.isna() | (years >= first)) & (last.isna() | (years <= last))).values
+
+# Precinct x period panel stored as integer-coded sparse coordinates: only valid (precinct, period) pairs exist
+# Note: periods are years, months or weeks (starting Monday) between start and stop years inclusive;
+# rows are mapped onto coordinates from Year (year), Year and Month (month) or a date column (week)
+# Note: a week that crosses a validity boundary (e.g. 2013-12-30 to 2014-01-05 for Precinct 121) is kept, and
+# only its rows dated inside the precinct's validity range are mapped onto it
+class Panel:
+    def __init__(self, precincts, start, stop, granularity="year", validity=PRECINCT_VALIDITY):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {GRANULARITIES}, got {granularity}")
+        self.precincts = sorted(set(str(p) for p in precincts))
+        self.start = start
+        self.stop = stop
+        self.granularity = granularity
+        self.validity = validity
+
+        # years of the first and last day of every period (both non-decreasing), used to apply validity ranges
+        if granularity == "year":
+            self.period_years = np.arange(start, stop + 1)
+        elif granularity == "month":
+            self.period_years = np.repeat(np.arange(start, stop + 1), 12)
+        else:
+            self.first_week = pd.Timestamp(start, 1, 1) - pd.Timedelta(days=pd.Timestamp(start, 1, 1).dayofweek)
+            weeks = pd.date_range(self.first_week, pd.Timestamp(stop, 12, 31), freq="7D")
+            self.period_years = np.maximum(weeks.year.values, start)
+        self.period_end_years = self.period_years if granularity != "week" else np.minimum((weeks + pd.Timedelta(days=6)).year.values, stop)
+        self.n_periods = len(self.period_years)
+
+        # contiguous valid period range per precinct, expanded to sorted flat coordinates p * n_periods + t
+        lo = np.zeros(len(self.precincts), dtype=np.int64)
+        hi = np.full(len(self.precincts), self.n_periods, dtype=np.int64)
+        for i, p in enumerate(self.precincts):
+            first, last = validity.get(p, (None, None))
+            if first is not None:
+                lo[i] = np.searchsorted(self.period_end_years, first, side="left")
+            if last is not None:
+                hi[i] = np.searchsorted(self.period_years, last, side="right")
+        n = np.maximum(hi - lo, 0)
+        self.precinct_codes = np.repeat(np.arange(len(self.precincts)), n)
+        self.period_codes = np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        self._flat = self.precinct_codes * self.n_periods + self.period_codes
+
+    def __len__(self):
+        return len(self._flat)
+
+    # Function to map frame rows onto coordinate positions (-1 for rows outside the panel or their validity range)
+    def codes(self, df, precinct="Precinct", year="Year", month="Month", date=None):
+        p = pd.Categorical(df[precinct].astype(str), categories=self.precincts).codes.astype(np.int64)
+        if self.granularity == "year":
+            t = df[year].values.astype(np.int64) - self.start
+        elif self.granularity == "month":
+            months = df[month].values.astype(np.int64)
+            t = np.where((months >= 1) & (months <= 12), (df[year].values.astype(np.int64) - self.start) * 12 + months - 1, -1)
+        else:
+            dates = pd.to_datetime(df[date])
+            days = (dates - self.first_week).dt.days.values
+            t = np.where(np.isnan(days), -1, days // 7).astype(np.int64)
+            t = np.where(valid_rows(pd.DataFrame({"Precinct": df[precinct].values, "Year": dates.dt.year.values}), validity=self.validity), t, -1)
+        flat = np.where((p >= 0) & (t >= 0) & (t < self.n_periods), p * self.n_periods + t, -1)
+        if not len(self._flat):
+            return np.full(len(flat), -1)
+        pos = np.minimum(np.searchsorted(self._flat, flat), len(self._flat) - 1)
+        return np.where((flat >= 0) & (self._flat[pos] == flat), pos, -1)
+
+    # Function to list the panel coordinates as a frame of period labels and precincts
+    def keys(self):
+        if self.granularity == "year":
+            periods = {"Year": self.start + self.period_codes}
+        elif self.granularity == "month":
+            periods = {"Year": self.start + self.period_codes // 12, "Month": self.period_codes % 12 + 1}
+        else:
+            periods = {"Week": self.first_week + pd.to_timedelta(7 * self.period_codes, unit="D")}
+        periods["Precinct"] = np.asarray(self.precincts, dtype=object)[self.precinct_codes]
+        return pd.DataFrame(periods)
+
+    # Function to count rows (value=None) or sum a column per coordinate, zero where a coordinate has no rows
+    def counts(self, df, value=None, **columns):
+        pos = self.codes(df, **columns)
+        keep = pos >= 0
+        weights = None if value is None else np.nan_to_num(df[value].values[keep].astype(np.float64))
+        return np.bincount(pos[keep], weights=weights, minlength=len(self)).astype(np.float64)
+
+    # Function to expand per-coordinate values to a zero-filled dense precinct x period array (only when needed)
+    def dense(self, values):
+        out = np.zeros((len(self.precincts), self.n_periods))
+        out[self.precinct_codes, self.period_codes] = values
+        return out
@@ -0,0 +1,307 @@
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError
+import collections
+import threading
+import boto3
+import struct
+import queue
+import gzip
+import bz2
+import io
+
+# Note: zstandard is optional; without it .zst objects are skipped in favour of other encodings
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Note: chunk_bytes sets the S3 read size, buffer_bytes caps how far each download may run ahead of its parser
+CHUNK_BYTES = 8 * 1024 * 1024
+BUFFER_BYTES = 64 * 1024 * 1024
+WORKERS = 8
+RETRIES = 5
+
+# Compressed variants of an object are stored as <key><extension>, tried in this order of preference
+COMPRESSIONS = (".zst", ".gz", ".bz2")
+
+# Note: recompress.py writes .zst objects as independent frames of CHUNK_BYTES uncompressed each, every one
+# preceded by a zstd skippable frame with this magic whose 4-byte payload is the next frame's compressed size;
+# frames can then be cut out of the stream and decompressed in parallel, while any zstd decoder still reads the
+# file as usual (skippable frames are ignored)
+ZSTD_INDEX_MAGIC = 0x184D2A5E
+
+# Sentinel marking the end of an object's byte stream
+_EOF = object()
+
+# Function to split a key into its logical (uncompressed) key and compression extension ("" if uncompressed)
+def split_compression(key):
+    for ext in COMPRESSIONS:
+        if key.endswith(ext):
+            return key[:-len(ext)], ext
+    return key, ""
+
+# Function to wrap a readable byte stream in a streaming decompressor for the given extension
+def decompressing_reader(f, ext):
+    if ext == ".gz":
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    if ext == ".bz2":
+        return bz2.BZ2File(f, mode="rb")
+    if ext == ".zst":
+        if zstandard is None:
+            raise ImportError("zstandard is required to read .zst objects")
+        return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+    return f
+
+# Function to check whether a buffered .zst stream starts with a frame index (i.e. was written by recompress.py)
+def is_indexed_zstd(f):
+    head = f.peek(4)[:4]
+    return len(head) == 4 and struct.unpack("<I", head)[0] == ZSTD_INDEX_MAGIC
+
+# Function to iterate over the compressed frames of an indexed .zst stream
+def zstd_frames(f):
+    while True:
+        header = f.read(12)
+        if not header:
+            return
+        if len(header) != 12:
+            raise ValueError("Truncated zstd frame index")
+        magic, size, n = struct.unpack("<III", header)
+        if magic != ZSTD_INDEX_MAGIC or size != 4:
+            raise ValueError("Expected a zstd frame index entry")
+        frame = f.read(n)
+        if len(frame) != n:
+            raise ValueError("Truncated zstd frame")
+        yield frame
+
+# Function to decompress one independent zstd frame (run on the decompression pool; zstandard releases the GIL)
+def _decompress_frame(frame):
+    return zstandard.ZstdDecompressor().decompress(frame)
+
+# Readable S3 object body that reconnects where it left off when the connection fails mid-read
+# Note: read-ahead downloads sit idle once their buffer is full (for as long as the parser takes to reach them),
+# so their connection may be reset by S3; the object is re-requested from the current byte offset, pinned
+# to the original ETag so a concurrently replaced object fails instead of being silently spliced
+class _RangedBody(io.RawIOBase):
+    def __init__(self, client, bucket, key, retries=RETRIES):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.retries = retries
+        self._offset = 0
+        self._etag = None
+        self._body = None
+
+    def readable(self):
+        return True
+
+    def _connect(self):
+        kwargs = {}
+        if self._offset:
+            kwargs["Range"] = f"bytes={self._offset}-"
+        if self._etag:
+            kwargs["IfMatch"] = self._etag
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, **kwargs)
+        self._etag = response["ETag"]
+        self._body = response["Body"]
+
+    def _disconnect(self):
+        if self._body is not None:
+            try:
+                self._body.close()
+            except Exception:
+                pass
+            self._body = None
+
+    def readinto(self, b):
+        for attempt in range(self.retries + 1):
+            try:
+                if self._body is None:
+                    self._connect()
+                data = self._body.read(len(b))
+                break
+            except (BotoCoreError, OSError) as e:
+                self._disconnect()
+                if attempt == self.retries:
+                    raise
+                print(f"Connection to s3://{self.bucket}/{self.key} lost at byte {self._offset} ({e}), reconnecting")
+        n = len(data)
+        b[:n] = data
+        self._offset += n
+        return n
+
+    def close(self):
+        self._disconnect()
+        super().close()
+
+# File-like view over a bounded queue of byte chunks, filled by a download thread and drained by a parser
+class _ObjectStream(io.RawIOBase):
+    def __init__(self, key, max_chunks):
+        self.key = key
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._abandoned = threading.Event()
+        self._pending = memoryview(b"")
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._pending):
+            if self._done:
+                return 0
+            item = self._chunks.get()
+            if item is _EOF:
+                self._done = True
+                return 0
+            if isinstance(item, BaseException):
+                self._done = True
+                raise item
+            self._pending = memoryview(item)
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        self._abandoned.set()
+        super().close()
+
+    # blocks while the buffer is full, giving up if the reader has closed the stream
+    def put(self, item):
+        while not self._abandoned.is_set():
+            try:
+                self._chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+# Prefetch S3 objects concurrently through a pooled client so downloads overlap with parsing
+# Note: objects should be requested (and later opened) in the order they are consumed; a download
+# only blocks once its buffer is full, so the object being parsed is always already in flight (objects opened
+# without being requested, or opened again, get their own download thread for the same reason)
+# Note: downloads run on daemon threads, so a run that raises before reading what it prefetched still exits
+# (a download blocked on a full buffer would otherwise keep the interpreter waiting forever)
+# Note: objects are requested by their uncompressed key; when a .zst/.gz/.bz2 variant exists it is downloaded
+# instead and decompressed as a stream on the download thread, so the buffer only ever holds decompressed chunks;
+# indexed .zst objects (see ZSTD_INDEX_MAGIC) have up to `workers` frames decompressing in parallel per download
+class S3Prefetcher:
+    def __init__(self, bucket, keys=(), workers=WORKERS, chunk_bytes=CHUNK_BYTES, buffer_bytes=BUFFER_BYTES):
+        self.bucket = bucket
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self.max_chunks = max(1, buffer_bytes // chunk_bytes)
+        self.client = boto3.session.Session().client("s3", config=Config(max_pool_connections=workers))
+        self._jobs = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, name=f"s3-prefetch-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        self._decompressors = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zstd")
+        self._streams = {}
+        self.prefetch(keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # list object keys under a prefix, in S3's lexicographic order
+    def list_raw(self, prefix):
+        keys = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(o["Key"] for o in page.get("Contents", []))
+        return keys
+
+    # list logical (uncompressed) object keys under a prefix, collapsing compressed variants
+    def list(self, prefix):
+        return sorted(set(split_compression(key)[0] for key in self.list_raw(prefix)))
+
+    # pick the stored object for a logical key, preferring compressed variants that can be decoded here
+    def resolve(self, key):
+        if split_compression(key)[1]:
+            return key
+        stored = set(self.list_raw(key))
+        for ext in COMPRESSIONS:
+            if key + ext in stored and (ext != ".zst" or zstandard is not None):
+                return key + ext
+        return key
+
+    # start downloading keys in the background (already-requested keys are skipped)
+    def prefetch(self, keys):
+        if isinstance(keys, str):
+            keys = [keys]
+        for key in keys:
+            if key not in self._streams:
+                stream = _ObjectStream(key, self.max_chunks)
+                self._streams[key] = stream
+                self._jobs.put(stream)
+
+    # worker loop: download requested objects in request order until close() sends a None per worker
+    def _work(self):
+        while True:
+            stream = self._jobs.get()
+            if stream is None:
+                return
+            self._download(stream)
+
+    def _download(self, stream):
+        if stream.closed:
+            return
+        try:
+            key = self.resolve(stream.key)
+            ext = split_compression(key)[1]
+            body = io.BufferedReader(_RangedBody(self.client, self.bucket, key), buffer_size=self.chunk_bytes)
+            if ext == ".zst" and is_indexed_zstd(body):
+                chunks = self._decompress_frames(body)
+            else:
+                reader = decompressing_reader(body, ext)
+                chunks = iter(lambda: reader.read(self.chunk_bytes), b"")
+            for chunk in chunks:
+                if not stream.put(chunk):
+                    body.close()
+                    return
+            body.close()
+            stream.put(_EOF)
+        except BaseException as e:
+            stream.put(e)
+
+    # decompress the frames of an indexed .zst stream in parallel, yielding them in order
+    def _decompress_frames(self, f):
+        pending = collections.deque()
+        for frame in zstd_frames(f):
+            pending.append(self._decompressors.submit(_decompress_frame, frame))
+            if len(pending) >= self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    # open a prefetched object as a binary file handle
+    # Note: a key that was not requested up front (or was already opened) is downloaded directly rather than
+    # queued behind read-ahead jobs that may be blocked until it is parsed
+    def open(self, key):
+        if key not in self._streams:
+            return self.open_direct(key)
+        return io.BufferedReader(self._streams.pop(key), buffer_size=self.chunk_bytes)
+
+    # open an object on its own download thread, outside the read-ahead queue (e.g. to read it a second time)
+    # Note: queued workers may all be blocked on full buffers of later objects, so a job appended to the queue
+    # now could wait forever on the very parse it is needed for
+    def open_direct(self, key):
+        stream = _ObjectStream(key, self.max_chunks)
+        threading.Thread(target=self._download, args=(stream,), name="s3-direct", daemon=True).start()
+        return io.BufferedReader(stream, buffer_size=self.chunk_bytes)
+
+    # read a prefetched object fully into memory
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def close(self):
+        for stream in self._streams.values():
+            stream.close()
+        self._streams = {}
+        for worker in self._workers:
+            self._jobs.put(None)
+        self._decompressors.shutdown(wait=False, cancel_futures=True)
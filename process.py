@@ -1,9 +1,14 @@
+from prefetch import S3Prefetcher
+from merges import guarded_merge
+from spatial import BoundaryIndex, reaggregate
+from rolling import RollingMetrics
+from panel import valid_rows
+from manifest import write_manifest
+from snapshot import write_snapshot
 from itertools import product
-from io import StringIO
 import pandas as pd
 import numpy as np
 import warnings
-import boto3
 import json
 import os
 
@@ -13,20 +18,35 @@ print("\n" + "*"*20 + "\n")
 
 # Connect to public AWS S3 bucket
 # Hosted by NYU's Public Safety Lab @ https://psl-ccrb.s3.amazonaws.com/
-S3 = boto3.resource("s3")
 BUCKET = "psl-ccrb"
 print(f"Connecting to NYU Public Safety Lab AWS S3 bucket {BUCKET}")
-conn = S3.Bucket(BUCKET)
+conn = S3Prefetcher(BUCKET)
+
+# Start downloading every raw object the run needs, in the order they are parsed below
+stops_fns = conn.list("raw/nyclu-stops-")
+conn.prefetch([
+    "raw/nyclu-misconduct-complaints.csv",
+    "raw/nyclu-misconduct-complaints-precinct-mapping.json",
+    "raw/keefe-census-2010-precinct-2020-mapping.csv",
+    "raw/keefe-census-2010-column-mapping.json",
+    "raw/kaplan-police.csv",
+    "raw/kaplan-arrests.csv",
+    "raw/kaplan-offenses.csv",
+] + stops_fns + [
+    "raw/nypd-crime-complaints.csv",
+    "raw/nypd-crime-complaints-type-mapping.csv",
+    "raw/nypd-arrests.csv",
+])
 
 # Ingest raw NYCLU's NYC CCRB data CSV and extract Year and Month from Incident Date (fill missing -1)
 # Data provided by NYCLU @ https://github.com/new-york-civil-liberties-union/NYPD-Misconduct-Complaint-Database
 print("Reading CCRB raw data")
-ccrb = pd.read_csv("s3://psl-ccrb/raw/nyclu-misconduct-complaints.csv")
+ccrb = pd.read_csv(conn.open("raw/nyclu-misconduct-complaints.csv"))
 ccrb["Year"] = pd.to_datetime(ccrb["Incident Date"]).dt.year.fillna("-1").astype(int)
 ccrb["Month"] = pd.to_datetime(ccrb["Incident Date"]).dt.month.fillna("-1").astype(int)
 
 # Extract precinct from CCRB Command field (fill missing -1)
-precinct_map = json.loads(S3.Bucket(BUCKET).Object("raw/nyclu-misconduct-complaints-precinct-mapping.json").get()["Body"].read().decode("utf-8"))
+precinct_map = json.loads(conn.read("raw/nyclu-misconduct-complaints-precinct-mapping.json").decode("utf-8"))
 precinct_map = dict(zip([d["Command"].strip() for d in precinct_map], [d["Complaints_Pct"].strip() for d in precinct_map]))
 ccrb["Precinct"] = ccrb["Command"].replace(precinct_map)
 ccrb["Precinct"] = np.where(ccrb["Precinct"].isin(precinct_map.values()), ccrb["Precinct"], "-1")
@@ -34,8 +54,8 @@ ccrb["Precinct"] = np.where(ccrb["Precinct"].isin(precinct_map.values()), ccrb["
 # Ingest 2010 US Census data mapped to 2020 NYPD precincts
 # Data provided by John Keefe @ https://johnkeefe.net/nyc-police-precinct-and-census-data)
 print("Reading Keefe 2010 Census 2020 NYPD precinct mapped data")
-census = pd.read_csv("s3://psl-ccrb/raw/keefe-census-2010-precinct-2020-mapping.csv")
-census_map = json.loads(S3.Bucket(BUCKET).Object("raw/keefe-census-2010-column-mapping.json").get()["Body"].read().decode("utf-8"))
+census = pd.read_csv(conn.open("raw/keefe-census-2010-precinct-2020-mapping.csv"))
+census_map = json.loads(conn.read("raw/keefe-census-2010-column-mapping.json").decode("utf-8"))
 census = census.rename(columns=census_map)
 census = census.drop([r for r in census.columns if r.startswith("P00")], axis=1)
 census_records = census.to_dict(orient="records")
@@ -65,40 +85,43 @@ demo["NH_White_Percent"] = demo["NH_White"]/demo["Total_Population"]
 demo["Other_Percent"] = demo["Others"]/demo["Total_Population"]
 census = demo.rename(columns={"Total_Population": "Total_Pop", "Others": "Other_Pop", "Hispanics": "Hispanic_Pop", "Black": "Black_Pop", "NH_Asian": "NH_Asian_Pop", "NH_White": "NH_White_Pop"})
 census["Census_Precinct"] = census["precinct_2020"].apply(lambda p: str(int(p)))
-ccrb = ccrb.join(census.set_index("Census_Precinct"), how="left", on="Precinct").drop(columns=["precinct_2020"])
+ccrb = guarded_merge(ccrb, census, how="left", left_on="Precinct", right_on="Census_Precinct", validate="m:1", name="census").drop(columns=["precinct_2020", "Census_Precinct"])
 
 # Ingest number of NYPD officers per year and merge
 # Data provided by Jacob Kaplan @ https://jacobdkaplan.com/
 print("Reading Kaplan NYPD officers data")
-num_officers = pd.read_csv("s3://psl-ccrb/raw/kaplan-police.csv")
+num_officers = pd.read_csv(conn.open("raw/kaplan-police.csv"))
 num_officers = num_officers[["year", "population", "total_employees_officers", "total_employees_total"]].rename(columns={"year": "Year", "population": "NYC_Pop_Year", "total_employees_officers": "Num_NYPD_Officers_Year", "total_employees_total": "Num_NYPD_Employees_Year"})
-ccrb = pd.merge(ccrb, num_officers, how="left", on="Year")
+ccrb = guarded_merge(ccrb, num_officers, how="left", on="Year", validate="m:1", name="officers")
 
 # Ingest number of arrests per year and merge
 # Data provided by Jacob Kaplan @ https://jacobdkaplan.com/
 print("Reading Kaplan NYC arrests data")
-num_arrests = pd.read_csv("s3://psl-ccrb/raw/kaplan-arrests.csv")
+num_arrests = pd.read_csv(conn.open("raw/kaplan-arrests.csv"))
 num_arrests = num_arrests[["year", "all_arrests_total_tot_arrests"]].rename(columns={"year": "Year", "all_arrests_total_tot_arrests": "Num_Arrests_Year"})
-ccrb = pd.merge(ccrb, num_arrests, how="left", on="Year")
+ccrb = guarded_merge(ccrb, num_arrests, how="left", on="Year", validate="m:1", name="annual arrests")
 
 # Ingest number of offenses per year and merge
 # Data provided by Jacob Kaplan @ https://jacobdkaplan.com/
 print("Reading Kaplan NYC offenses data")
-num_offenses = pd.read_csv("s3://psl-ccrb/raw/kaplan-offenses.csv")
+num_offenses = pd.read_csv(conn.open("raw/kaplan-offenses.csv"))
 num_offenses = num_offenses[["year", "actual_all_crimes", "tot_clr_all_crimes"]].rename(columns={"year": "Year", "actual_all_crimes": "Num_Offenses_Year", "tot_clr_all_crimes": "Num_Offenses_Cleared_Year"})
-ccrb = pd.merge(ccrb, num_offenses, how="left", on="Year")
+ccrb = guarded_merge(ccrb, num_offenses, how="left", on="Year", validate="m:1", name="offenses")
 
 # Ingest NYPD stop-and-frisk data
 # Data provided by NYC/NYPD @ https://www1.nyc.gov/site/nypd/stats/reports-analysis/stopfrisk.page
 # Note: DtypeWarning can be suppressed by specifying column data types
-fns = [object_summary.key for object_summary in conn.objects.filter(Prefix=f"raw/nyclu-stops-")]
 dfs = []
-for fn in fns:
+for fn in stops_fns:
     print(f"Reading NYPD stop-and-frisk yearly file for {fn.split('-')[-1].split('.')[0]}")
     try:
-        dfs.append(pd.read_csv(StringIO(S3.Bucket(BUCKET).Object(fn).get()["Body"].read().decode("utf-8"))))
-    except:
-        dfs.append(pd.read_csv(StringIO(S3.Bucket(BUCKET).Object(fn).get()["Body"].read().decode("iso-8859-1"))))
+        with conn.open(fn) as f:
+            dfs.append(pd.read_csv(f, encoding="utf-8"))
+    except UnicodeDecodeError:
+        # some years are not utf-8: stream the object again on its own connection (not behind the read-ahead
+        # queue, whose workers may be waiting on this parse) rather than keeping it in memory to retry
+        with conn.open_direct(fn) as f:
+            dfs.append(pd.read_csv(f, encoding="iso-8859-1"))
         
 # Function to extract month from some stops CSVs
 def extract_stops_month(s):
@@ -142,10 +165,10 @@ mo_stops_counts_df = mo_precinct_stops_counts_df.groupby(["Year", "Month"])["Sto
 yr_stops_counts_df = mo_stops_counts_df.groupby(["Year"])["Stops_Month"].sum().reset_index().rename(columns={"Stops_Month": "Stops_Year"})
 
 # Merge stops counts by year, month, precinct-year and precinct-month
-ccrb = pd.merge(ccrb, yr_stops_counts_df, how="left", on="Year")
-ccrb = pd.merge(ccrb, yr_precinct_stops_counts_df, how="left", on=["Precinct", "Year"])
-ccrb = pd.merge(ccrb, mo_stops_counts_df, how="left", on=["Year", "Month"])
-ccrb = pd.merge(ccrb, mo_precinct_stops_counts_df, how="left", on=["Year", "Month", "Precinct"])
+ccrb = guarded_merge(ccrb, yr_stops_counts_df, how="left", on="Year", validate="m:1", name="stops by year")
+ccrb = guarded_merge(ccrb, yr_precinct_stops_counts_df, how="left", on=["Precinct", "Year"], validate="m:1", name="stops by precinct-year")
+ccrb = guarded_merge(ccrb, mo_stops_counts_df, how="left", on=["Year", "Month"], validate="m:1", name="stops by month")
+ccrb = guarded_merge(ccrb, mo_precinct_stops_counts_df, how="left", on=["Year", "Month", "Precinct"], validate="m:1", name="stops by precinct-month")
 
 # Save intermediate CSV to tmp directory of S3 bucket
 print("Saving intermediate data to s3://psl-ccrb/tmp/")
@@ -158,14 +181,14 @@ ccrb.to_csv("s3://psl-ccrb/tmp/ccrb-minus-crime-complaints.csv", index=False)
 complaints = pd.DataFrame()
 chunk_rows = 2000000
 i = 1
-for chunk in pd.read_csv("s3://psl-ccrb/raw/nypd-crime-complaints.csv", chunksize=chunk_rows):
+for chunk in pd.read_csv(conn.open("raw/nypd-crime-complaints.csv"), chunksize=chunk_rows):
     print(f"Reading NYC Open Data crime complaint data rows {(i-1)*chunk_rows+1}-{i*chunk_rows}")
     complaints = pd.concat([complaints, chunk])
     i += 1
     
 # Read in offense type mapping JSON and mere with crime complaints
-offense_types = pd.read_csv("s3://psl-ccrb/raw/nypd-crime-complaints-type-mapping.csv")
-complaints_df = pd.merge(complaints, offense_types[["OFNS_DESC", "OFNS_TYPE"]], how="left", on="OFNS_DESC")
+offense_types = pd.read_csv(conn.open("raw/nypd-crime-complaints-type-mapping.csv"))
+complaints_df = guarded_merge(complaints, offense_types[["OFNS_DESC", "OFNS_TYPE"]], how="left", on="OFNS_DESC", validate="m:1", name="offense types")
 complaints_df = complaints_df[complaints_df["OFNS_TYPE"].notnull()]
 
 # Select years from 1980 to present
@@ -190,7 +213,7 @@ for c in crime_complaints_yearly.columns:
 for c in crime_complaints_monthly.columns:
     if c not in ["YEAR", "MONTH"]:
         crime_complaints_monthly = crime_complaints_monthly.rename(columns={c:f"Num_Crime_Complaints_{c.capitalize()}_Month"})
-crime_complaints = pd.merge(crime_complaints_monthly, crime_complaints_yearly, on=["YEAR"])
+crime_complaints = guarded_merge(crime_complaints_monthly, crime_complaints_yearly, on=["YEAR"], validate="m:1", name="crime complaints by year")
 
 # Save intermediate CSV to tmp directory of S3 bucket
 crime_complaints.to_csv("s3://psl-ccrb/tmp/nypd-crime-complaints-count-by-year-month.csv", index=False)
@@ -204,14 +227,24 @@ for c in precinct_crime_complaints_yearly.columns:
 for c in precinct_crime_complaints_monthly.columns:
     if c not in ["YEAR", "MONTH", "ADDR_PCT_CD"]:
         precinct_crime_complaints_monthly = precinct_crime_complaints_monthly.rename(columns={c:f"Num_Crime_Complaints_{c.capitalize()}_Precinct_Month"})
-precinct_crime_complaints = pd.merge(precinct_crime_complaints_monthly, precinct_crime_complaints_yearly, on=["YEAR", "ADDR_PCT_CD"])
+precinct_crime_complaints = guarded_merge(precinct_crime_complaints_monthly, precinct_crime_complaints_yearly, on=["YEAR", "ADDR_PCT_CD"], validate="m:1", name="crime complaints by precinct-year")
 
 # Save intermediate CSV to tmp directory of S3 bucket
 precinct_crime_complaints.to_csv("s3://psl-ccrb/tmp/nypd-crime-complaints-count-by-precinct-year-month.csv", index=False)
 
+# Re-aggregate crime complaints by their coordinates to any locally supplied boundary files
+# Note: optional, reads boundaries/<name>.geojson (e.g. a precinct vintage or census tracts) keyed on its first feature property
+if os.path.isdir("boundaries"):
+    for fn in sorted(os.listdir("boundaries")):
+        if fn.endswith(".geojson"):
+            print(f"Re-aggregating crime complaints to boundaries/{fn}")
+            boundary_index = BoundaryIndex.from_geojson(f"boundaries/{fn}")
+            boundary_counts = reaggregate(complaints_df, boundary_index, by=["YEAR", "MONTH", "OFNS_TYPE"])
+            boundary_counts.to_csv(f"s3://psl-ccrb/tmp/nypd-crime-complaints-count-by-{boundary_index.name}-year-month.csv", index=False)
+
 # Merge crime complaints
-ccrb = pd.merge(ccrb, crime_complaints, how="left", left_on=["Year", "Month"], right_on=["YEAR", "MONTH"])
-ccrb = pd.merge(ccrb, precinct_crime_complaints, how="left", left_on=["Year", "Month", "Precinct"], right_on=["YEAR", "MONTH", "ADDR_PCT_CD"])
+ccrb = guarded_merge(ccrb, crime_complaints, how="left", left_on=["Year", "Month"], right_on=["YEAR", "MONTH"], validate="m:1", name="crime complaints by month")
+ccrb = guarded_merge(ccrb, precinct_crime_complaints, how="left", left_on=["Year", "Month", "Precinct"], right_on=["YEAR", "MONTH", "ADDR_PCT_CD"], validate="m:1", name="crime complaints by precinct-month")
 ccrb = ccrb.drop(columns={"YEAR_x", "MONTH_x", "YEAR_y", "MONTH_y", "ADDR_PCT_CD"})
 
 # Ingest NYPD arrests file
@@ -221,29 +254,37 @@ ccrb = ccrb.drop(columns={"YEAR_x", "MONTH_x", "YEAR_y", "MONTH_y", "ADDR_PCT_CD
 arrests = pd.DataFrame()
 chunk_rows = 2000000
 i = 1
-for chunk in pd.read_csv("s3://psl-ccrb/raw/nypd-arrests.csv", chunksize=chunk_rows):
+for chunk in pd.read_csv(conn.open("raw/nypd-arrests.csv"), chunksize=chunk_rows):
     print(f"Reading NYC Open Data arrest data rows {(i-1)*chunk_rows+1}-{i*chunk_rows}")
     arrests = pd.concat([arrests, chunk])
     i += 1
+conn.close()
 
 # Process arrests data
 arrests = arrests[arrests["ARREST_PRECINCT"] != 27]
 arrests["Year"] = pd.to_datetime(arrests["ARREST_DATE"]).dt.year.fillna("-1").astype(int)
 arrests["Precinct"] = arrests["ARREST_PRECINCT"].astype(str)
 arrests_counts = arrests.groupby(["Precinct", "Year"])["ARREST_KEY"].count().reset_index().rename(columns={"ARREST_KEY": "Arrests_Precinct_Year"})
-pct_121 = arrests_counts[(arrests_counts["Precinct"] == "121") & (arrests_counts["Year"] == 2013)]
-arrests_counts = arrests_counts[~arrests_counts.isin(pct_121)]
-arrests_counts = arrests_counts[arrests_counts["Year"].notna()]
+arrests_counts = arrests_counts[valid_rows(arrests_counts)]
 
 # Save intermediate CSV to tmp directory of S3 bucket
 arrests_counts.to_csv("s3://psl-ccrb/tmp/nypd-arrests-counts-by-precinct-year.csv", index=False)
 
 # Merge arrests data and finalize
-final = pd.merge(ccrb, arrests_counts, how="left", on=["Year", "Precinct"])
+final = guarded_merge(ccrb, arrests_counts, how="left", on=["Year", "Precinct"], validate="m:1", name="arrests by precinct-year")
+
+# Compute rolling 3/12/36-month complaint rates per 1,000 stops and per crime report by precinct-month
+print("Computing rolling precinct-month metrics")
+rolling = RollingMetrics.from_frames(final, mo_precinct_stops_counts_df, precinct_crime_complaints_monthly).compute()
+rolling.to_csv("s3://psl-ccrb/out/data-rolling-by-precinct-month.csv", index=False)
 
 # Save final CSV to out directory of S3 bucket
 print("Saving final data to s3://psl-ccrb/out/")
 final.to_csv("s3://psl-ccrb/out/data.csv", index=False)
+write_manifest(final, "s3://psl-ccrb/out/data.csv")
+
+# Refresh the local memory-mapped snapshot that visualize.py and notebooks open instead of re-parsing the CSV
+write_snapshot(final, os.path.join(os.environ.get("PSL_CCRB_CACHE", "cache"), "data.snapshot"))
 
 # Save final CSV to chunks under GitHub size limit in out directory
 cols = list(final.columns)
@@ -253,11 +294,14 @@ if not os.path.isdir("out"):
 os.system("split -a 1 -l 60000 data.csv out/data_chunk_")
 os.system("for file in out/data_chunk_*; do mv ${file} ${file}.csv; done")
 os.remove("data.csv")
-for i, f in enumerate(sorted(os.listdir("out"))):
+for i, f in enumerate(sorted(f for f in os.listdir("out") if f.startswith("data_chunk_"))):
     if i==0:
         tmp = pd.read_csv(f"out/{f}")
     else:
         tmp = pd.read_csv(f"out/{f}", names=cols)
     os.remove(f"out/{f}")
     tmp.to_csv(f"out/{'_'.join(f.split('_')[0:2])}_{i}.csv", index=False)
+
+# Save manifest of per-year, per-column-block content hashes covering the chunks, for comparing runs
+write_manifest(final, "out/data.csv")
 print("\n" + "*"*20 + "\n")
\ No newline at end of file
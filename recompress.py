@@ -0,0 +1,104 @@
+from prefetch import COMPRESSIONS, ZSTD_INDEX_MAGIC, split_compression, zstandard
+from botocore.config import Config
+import argparse
+import boto3
+import struct
+import zlib
+import bz2
+import io
+
+# Public AWS S3 bucket hosted by NYU's Public Safety Lab @ https://psl-ccrb.s3.amazonaws.com/
+BUCKET = "psl-ccrb"
+PREFIX = "raw/"
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Readable stream that compresses another readable stream on the fly (for formats without a streaming reader)
+class _CompressingReader(io.RawIOBase):
+    def __init__(self, f, compressor):
+        self._f = f
+        self._compressor = compressor
+        self._pending = b""
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending and not self._done:
+            chunk = self._f.read(CHUNK_BYTES)
+            if chunk:
+                self._pending = self._compressor.compress(chunk)
+            else:
+                self._pending = self._compressor.flush()
+                self._done = True
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+# Compressor writing each chunk as an independent zstd frame preceded by its frame index entry
+# (see prefetch.ZSTD_INDEX_MAGIC), so process.py can decompress the frames in parallel
+class _FrameCompressor:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+
+    def compress(self, chunk):
+        frame = self._compressor.compress(chunk)
+        return struct.pack("<III", ZSTD_INDEX_MAGIC, 4, len(frame)) + frame
+
+    def flush(self):
+        return b""
+
+# Function to wrap a readable byte stream in a streaming compressor for the given extension
+# Note: zstd compresses on all cores (threads=-1) into independent CHUNK_BYTES frames; gzip and bz2 are
+# single-threaded single streams
+def compressing_reader(f, ext, level):
+    if ext == ".zst":
+        if zstandard is None:
+            raise ImportError("zstandard is required to write .zst objects")
+        return _CompressingReader(f, _FrameCompressor(level))
+    if ext == ".gz":
+        return _CompressingReader(f, zlib.compressobj(level, zlib.DEFLATED, 31))
+    if ext == ".bz2":
+        return _CompressingReader(f, bz2.BZ2Compressor(level))
+    raise ValueError(f"Unsupported compression {ext}")
+
+# Function to recompress every uncompressed object under a prefix, streaming download -> compress -> multipart upload
+# Note: originals are kept unless delete=True; process.py reads the compressed variant whenever one exists
+def recompress(prefix=PREFIX, ext=".zst", level=None, delete=False, dry_run=False):
+    if level is None:
+        level = {".zst": 12, ".gz": 6, ".bz2": 9}[ext]
+    client = boto3.session.Session().client("s3", config=Config(max_pool_connections=16))
+    objects = {}
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=prefix):
+        objects.update((o["Key"], o["Size"]) for o in page.get("Contents", []))
+
+    for key, size in sorted(objects.items()):
+        if split_compression(key)[1] or key.endswith("/"):
+            continue
+        if any(key + e in objects for e in COMPRESSIONS):
+            print(f"Skipping {key} (already compressed)")
+            continue
+        print(f"Recompressing s3://{BUCKET}/{key} ({size / 1e6:.1f} MB) to {key}{ext}")
+        if dry_run:
+            continue
+        body = client.get_object(Bucket=BUCKET, Key=key)["Body"]
+        client.upload_fileobj(compressing_reader(body, ext, level), BUCKET, key + ext)
+        compressed = client.head_object(Bucket=BUCKET, Key=key + ext)["ContentLength"]
+        print(f"Wrote {key}{ext} ({compressed / 1e6:.1f} MB, {size / max(compressed, 1):.1f}x)")
+        if delete:
+            client.delete_object(Bucket=BUCKET, Key=key)
+
+# Command line entry point, e.g. `python recompress.py --format zst`
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="recompress", description=f"Recompress raw input objects in s3://{BUCKET}/")
+    parser.add_argument("--prefix", default=PREFIX, help=f"key prefix to recompress (default {PREFIX})")
+    parser.add_argument("--format", choices=[e.lstrip(".") for e in COMPRESSIONS], default="zst", help="compression format (default zst)")
+    parser.add_argument("--level", type=int, help="compression level (default 12 for zst, 6 for gz, 9 for bz2)")
+    parser.add_argument("--delete", action="store_true", help="delete each uncompressed original after uploading its compressed copy")
+    parser.add_argument("--dry-run", action="store_true", help="only list the objects that would be recompressed")
+    args = parser.parse_args(argv)
+    recompress(args.prefix, f".{args.format}", args.level, args.delete, args.dry_run)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import pandas as pd
+import numpy as np
+import warnings
+
+# Note: windows are in months; rates are per 1,000 stops and per crime report
+WINDOWS = (3, 12, 36)
+PER_STOPS = 1000
+
+# Function to build a dense precinct x month array of row counts (value=None) or summed values from a long frame
+# Note: rows with precincts outside `precincts` or months outside the span (including the -1 fill) are dropped
+def monthly_array(df, precincts, start_year, n_months, value=None, year="Year", month="Month", precinct="Precinct"):
+    p = pd.Categorical(df[precinct].astype(str), categories=precincts).codes.astype(np.int64)
+    t = (df[year].values.astype(np.int64) - start_year) * 12 + df[month].values.astype(np.int64) - 1
+    keep = (p >= 0) & (t >= 0) & (t < n_months) & (df[month].values >= 1) & (df[month].values <= 12)
+    weights = None if value is None else np.nan_to_num(df[value].values[keep].astype(np.float64))
+    flat = np.bincount(p[keep] * n_months + t[keep], weights=weights, minlength=len(precincts) * n_months)
+    return flat.astype(np.float64).reshape(len(precincts), n_months)
+
+# Function to compute trailing window sums for every precinct and month at once by cumulative-sum differencing
+# Note: months before a full window is available are NaN
+def window_sums(arr, window):
+    cs = np.zeros((arr.shape[0], arr.shape[1] + 1))
+    np.cumsum(arr, axis=1, out=cs[:, 1:])
+    sums = np.full(arr.shape, np.nan)
+    sums[:, window - 1:] = cs[:, window:] - cs[:, :-window]
+    return sums
+
+# Function to divide window sums, leaving NaN where the denominator is zero or missing
+def rate(numerator, denominator, per=1):
+    out = np.full(numerator.shape, np.nan)
+    np.divide(per * numerator, denominator, out=out, where=np.nan_to_num(denominator) > 0)
+    return out
+
+# Function to z-score each month's values across precincts
+def zscore(arr):
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(arr, axis=0)
+        std = np.nanstd(arr, axis=0)
+        return np.where(std > 0, (arr - mean) / std, np.nan)
+
+# Rolling complaint, stop and crime metrics over dense per-precinct monthly series
+class RollingMetrics:
+    def __init__(self, precincts, start_year, complaints, stops, crimes):
+        self.precincts = list(precincts)
+        self.start_year = start_year
+        self.complaints = complaints
+        self.stops = stops
+        self.crimes = crimes
+
+    # Function to build the dense series once from the processed CCRB rows, monthly precinct stop counts
+    # (Stops_Precinct_Month) and monthly precinct crime complaint counts (Num_Crime_Complaints_*_Precinct_Month)
+    # Note: complaints are CCRB rows with a Unique Id, matching the complaint counts in visualize.compile_precincts
+    @classmethod
+    def from_frames(cls, ccrb, stops, crimes, crimes_year="YEAR", crimes_month="MONTH", crimes_precinct="ADDR_PCT_CD"):
+        crime_cols = [c for c in crimes.columns if c.startswith("Num_Crime_Complaints_") and c.endswith("_Precinct_Month")]
+        crimes = crimes[[crimes_year, crimes_month, crimes_precinct]].assign(Crime_Reports=crimes[crime_cols].sum(axis=1))
+        crimes = crimes.rename(columns={crimes_year: "Year", crimes_month: "Month", crimes_precinct: "Precinct"})
+
+        frames = [ccrb, stops, crimes]
+        precincts = sorted(set().union(*[set(df["Precinct"].astype(str)) for df in frames]) - {"-1"})
+        # span from January of the first year seen to the last month observed in any input (not the end of its
+        # year, so the latest month has data)
+        months = np.concatenate([
+            df["Year"].values.astype(np.int64) * 12 + df["Month"].values.astype(np.int64) - 1
+            for df in frames
+        ])
+        valid = np.concatenate([(df["Year"].values > 0) & (df["Month"].values >= 1) & (df["Month"].values <= 12) for df in frames])
+        start_year = int(months[valid].min()) // 12
+        n_months = int(months[valid].max()) - start_year * 12 + 1
+
+        return cls(
+            precincts,
+            start_year,
+            monthly_array(ccrb[ccrb["Unique Id"].notna()], precincts, start_year, n_months),
+            monthly_array(stops, precincts, start_year, n_months, value="Stops_Precinct_Month"),
+            monthly_array(crimes, precincts, start_year, n_months, value="Crime_Reports"),
+        )
+
+    # Function to compute window sums, rates and cross-precinct z-scores for every window in one vectorized pass
+    # Note: latest=True keeps only each window's most recent month, for monitoring
+    def compute(self, windows=WINDOWS, latest=False):
+        n_precincts, n_months = self.complaints.shape
+        months = np.arange(n_months)
+        if latest:
+            months = months[-1:]
+        out = []
+        for window in windows:
+            complaints = window_sums(self.complaints, window)
+            stops = window_sums(self.stops, window)
+            crimes = window_sums(self.crimes, window)
+            per_stops = rate(complaints, stops, PER_STOPS)
+            per_crime = rate(complaints, crimes)
+            columns = {
+                "Complaints": complaints,
+                "Stops": stops,
+                "Crime_Reports": crimes,
+                "Complaints_per_1000_Stops": per_stops,
+                "Complaints_per_1000_Stops_Z": zscore(per_stops),
+                "Complaints_per_Crime_Report": per_crime,
+                "Complaints_per_Crime_Report_Z": zscore(per_crime),
+            }
+            df = pd.DataFrame({
+                "Precinct": np.repeat(self.precincts, len(months)),
+                "Year": np.tile(self.start_year + months // 12, n_precincts),
+                "Month": np.tile(months % 12 + 1, n_precincts),
+                "Window_Months": window,
+            })
+            for name, arr in columns.items():
+                df[f"Rolling_{name}"] = arr[:, months].ravel()
+            out.append(df)
+        return pd.concat(out, ignore_index=True)
@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+
+# Snapshot file layout: MAGIC, 8-byte little-endian header length, JSON schema header, then one 64-byte aligned
+# buffer per column; numeric, bool and datetime columns are stored raw, everything else as categorical codes
+# Note: opening maps the file read-only, so raw columns are views on shared page-cache pages and concurrent
+# readers share one physical copy; frames built from it are read-only (assigning new columns is fine)
+# Note: string (object/str) columns are rebuilt in their original dtype from their codes on open, the one copy
+# made; non-string values in object columns come back as strings
+MAGIC = b"PSLSNAP1"
+ALIGN = 64
+
+# Function to split a column into its stored buffer and schema entry
+def _encode(name, s):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes, categories, source = s.cat.codes.values, list(s.cat.categories), "category"
+    elif pd.api.types.is_datetime64_dtype(s) or s.dtype == bool:
+        return s.values, {"name": name, "kind": "raw", "dtype": str(s.dtype)}
+    elif pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        values = s.values if isinstance(s.dtype, np.dtype) and s.dtype.kind in "iuf" else s.to_numpy(dtype=np.float64, na_value=np.nan)
+        return values, {"name": name, "kind": "raw", "dtype": str(values.dtype)}
+    else:
+        cat = pd.Categorical(s.astype(object).where(s.notna(), None).map(lambda v: v if v is None else str(v)))
+        codes, categories, source = cat.codes, list(cat.categories), str(s.dtype)
+    return codes, {"name": name, "kind": "category", "dtype": str(codes.dtype), "source": source, "categories": [c if isinstance(c, (str, int, float)) else str(c) for c in categories]}
+
+# Function to write a frame as a memory-mappable snapshot (atomically, so readers never see a partial file)
+def write_snapshot(df, path):
+    buffers, columns = [], []
+    for name in df.columns:
+        values, entry = _encode(str(name), df[name])
+        buffers.append(np.ascontiguousarray(values))
+        columns.append(entry)
+
+    # offsets are relative to the start of the data section, which begins on an aligned boundary after the header
+    offset = 0
+    for buf, entry in zip(buffers, columns):
+        entry["offset"] = offset
+        entry["nbytes"] = buf.nbytes
+        offset += -(-buf.nbytes // ALIGN) * ALIGN
+    header = json.dumps({"rows": len(df), "columns": columns}).encode("utf-8")
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for buf, entry in zip(buffers, columns):
+            f.seek(start + entry["offset"])
+            f.write(buf.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+# Function to read a snapshot's schema header (and where its data section starts) without mapping the data
+def read_schema(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        header_len = int.from_bytes(f.read(8), "little")
+        schema = json.loads(f.read(header_len))
+    schema["start"] = -(-(len(MAGIC) + 8 + header_len) // ALIGN) * ALIGN
+    return schema
+
+# Function to open a snapshot as a read-only DataFrame whose columns are zero-copy views on the mapped file
+# Note: the frame gets a fresh RangeIndex; categorical columns stay zero-copy categoricals over the mapped codes
+def open_snapshot(path, columns=None):
+    schema = read_schema(path)
+    start = schema["start"]
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    data = {}
+    for entry in schema["columns"]:
+        if columns is not None and entry["name"] not in columns:
+            continue
+        values = mapped[start + entry["offset"]:start + entry["offset"] + entry["nbytes"]].view(entry["dtype"])
+        values = np.asarray(values)
+        if entry["kind"] == "category":
+            values = pd.Categorical.from_codes(values, categories=pd.Index(entry["categories"]))
+            if entry.get("source", "category") != "category":
+                values = pd.Series(np.asarray(values, dtype=object), dtype=entry["source"], copy=False)
+        data[entry["name"]] = values
+    return pd.DataFrame(data, copy=False)
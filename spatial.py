@@ -0,0 +1,154 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+
+# Note: grid_cells sets the index resolution per side, max_pairs caps the point x edge block evaluated at once
+GRID_CELLS = 256
+MAX_PAIRS = 4000000
+
+# Function to collect the rings (outer boundaries and holes) of a GeoJSON Polygon/MultiPolygon geometry
+def _rings(geometry):
+    if geometry["type"] == "Polygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    raise ValueError(f"Unsupported geometry type {geometry['type']}")
+
+# Grid index over a set of boundary polygons (e.g. one precinct vintage or the census tracts) for batched point-in-polygon lookups
+# Note: coordinates are treated as planar, so points and boundaries must share a coordinate system (GeoJSON is lon/lat);
+# grid cells no boundary edge passes through are resolved once from their centre, and only points in cells crossed by
+# edges are ray-cast, against the edges spanning that grid row
+class BoundaryIndex:
+    def __init__(self, regions, rings, cells=GRID_CELLS, name=None):
+        self.name = name
+        self.regions = list(regions)
+
+        # edges of every ring, tagged with the code of the region they bound
+        x0, y0, x1, y1, reg = [], [], [], [], []
+        for code, ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) < 3:
+                continue
+            if (ring[0] != ring[-1]).any():
+                ring = np.vstack([ring, ring[:1]])
+            x0.append(ring[:-1, 0])
+            y0.append(ring[:-1, 1])
+            x1.append(ring[1:, 0])
+            y1.append(ring[1:, 1])
+            reg.append(np.full(len(ring) - 1, code, dtype=np.int64))
+        self._x0, self._y0, self._x1, self._y1, self._reg = [np.concatenate(a) for a in (x0, y0, x1, y1, reg)]
+
+        # grid geometry
+        self.nx = self.ny = cells
+        self.minx = min(self._x0.min(), self._x1.min())
+        self.miny = min(self._y0.min(), self._y1.min())
+        self.cell_w = (max(self._x0.max(), self._x1.max()) - self.minx) / self.nx
+        self.cell_h = (max(self._y0.max(), self._y1.max()) - self.miny) / self.ny
+
+        # edges spanning each grid row, sorted by region within the row (CSR layout)
+        r0 = self._rows(np.minimum(self._y0, self._y1))
+        r1 = self._rows(np.maximum(self._y0, self._y1))
+        edges, rows = self._expand(np.arange(len(self._reg)), r0, r1)
+        order = np.lexsort((self._reg[edges], rows))
+        self._row_edges = edges[order]
+        self._row_ptr = np.searchsorted(rows[order], np.arange(self.ny + 1))
+
+        # grid cells touched by the bounding box of any edge
+        c0 = self._cols(np.minimum(self._x0, self._x1))
+        c1 = self._cols(np.maximum(self._x0, self._x1))
+        edge_cells, cell_rows = self._expand(np.arange(len(self._reg)), r0, r1)
+        _, cell_cols = self._expand(edge_cells, c0[edge_cells], c1[edge_cells])
+        cell_rows = np.repeat(cell_rows, c1[edge_cells] - c0[edge_cells] + 1)
+        crossed = np.zeros((self.ny, self.nx), dtype=bool)
+        crossed[cell_rows, cell_cols] = True
+
+        # region of every cell no edge passes through, taken from its centre; -2 marks cells needing exact tests
+        self._cell_region = np.full((self.ny, self.nx), -2, dtype=np.int64)
+        rows, cols = np.nonzero(~crossed)
+        centres = self._locate_exact(self.minx + (cols + 0.5) * self.cell_w, self.miny + (rows + 0.5) * self.cell_h, rows)
+        self._cell_region[rows, cols] = centres
+
+    # Function to build an index from a GeoJSON FeatureCollection, keyed on a feature property (default: the first one)
+    @classmethod
+    def from_geojson(cls, path, id_property=None, cells=GRID_CELLS):
+        with open(path) as f:
+            features = json.load(f)["features"]
+        if id_property is None:
+            id_property = next(iter(features[0]["properties"]))
+        regions, codes, rings = [], {}, []
+        for feature in features:
+            region = str(feature["properties"][id_property])
+            if region not in codes:
+                codes[region] = len(regions)
+                regions.append(region)
+            rings.extend((codes[region], ring) for ring in _rings(feature["geometry"]))
+        name = os.path.basename(path).split(".")[0]
+        return cls(regions, rings, cells=cells, name=name)
+
+    def _rows(self, y):
+        return np.clip(((y - self.miny) / self.cell_h).astype(np.int64), 0, self.ny - 1)
+
+    def _cols(self, x):
+        return np.clip(((x - self.minx) / self.cell_w).astype(np.int64), 0, self.nx - 1)
+
+    # expand each item i into one entry per integer in [lo[i], hi[i]], returning (items, values)
+    @staticmethod
+    def _expand(items, lo, hi):
+        n = hi - lo + 1
+        starts = np.cumsum(n) - n
+        return np.repeat(items, n), np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(starts, n)
+
+    # ray-cast points against the edges of their grid row, returning region codes (-1 outside every region)
+    # Note: region membership uses the even-odd rule, so holes are handled; overlapping regions resolve to the lowest code
+    def _locate_exact(self, x, y, rows):
+        codes = np.full(len(x), -1, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        bounds = np.searchsorted(rows[order], np.arange(self.ny + 1))
+        for row in np.flatnonzero(np.diff(bounds)):
+            edges = self._row_edges[self._row_ptr[row]:self._row_ptr[row + 1]]
+            if not len(edges):
+                continue
+            regs = self._reg[edges]
+            starts = np.flatnonzero(np.r_[True, regs[1:] != regs[:-1]])
+            ex0, ey0, ex1, ey1 = self._x0[edges], self._y0[edges], self._x1[edges], self._y1[edges]
+            points = order[bounds[row]:bounds[row + 1]]
+            step = max(1, MAX_PAIRS // len(edges))
+            for i in range(0, len(points), step):
+                p = points[i:i + step]
+                px, py = x[p, None], y[p, None]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    hits = ((ey0 > py) != (ey1 > py)) & (px < ex0 + (py - ey0) * (ex1 - ex0) / (ey1 - ey0))
+                inside = (np.add.reduceat(hits.view(np.uint8), starts, axis=1) & 1).astype(bool)
+                codes[p] = np.where(inside.any(axis=1), regs[starts][inside.argmax(axis=1)], -1)
+        return codes
+
+    # Function to map arrays of points (x = longitude, y = latitude) to region codes in one batched pass (-1 unmatched)
+    def locate(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        codes = np.full(len(x), -1, dtype=np.int64)
+        valid = np.isfinite(x) & np.isfinite(y)
+        valid &= (x >= self.minx) & (x <= self.minx + self.nx * self.cell_w)
+        valid &= (y >= self.miny) & (y <= self.miny + self.ny * self.cell_h)
+        idx = np.flatnonzero(valid)
+        rows, cols = self._rows(y[idx]), self._cols(x[idx])
+        cell = self._cell_region[rows, cols]
+        codes[idx] = cell
+        exact = cell == -2
+        codes[idx[exact]] = self._locate_exact(x[idx[exact]], y[idx[exact]], rows[exact])
+        return codes
+
+    # Function to map arrays of points to region ids ("-1" where unmatched, which code -1 indexes as the last entry)
+    def assign(self, x, y):
+        return np.append(np.asarray(self.regions, dtype=object), "-1")[self.locate(x, y)]
+
+# Function to count rows of a point table (e.g. crime complaints) per region of a boundary index and any grouping columns
+def reaggregate(df, index, by=(), lon="Longitude", lat="Latitude"):
+    column = index.name or "Region"
+    codes = index.locate(df[lon].values, df[lat].values)
+    g = pd.DataFrame({c: df[c].values for c in by})
+    g[column] = codes
+    counts = g.groupby(list(by) + [column]).size().reset_index(name="Count")
+    counts[column] = np.append(np.asarray(index.regions, dtype=object), "-1")[counts[column].values]
+    return counts
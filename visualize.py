@@ -1,30 +1,32 @@
-from plotly.subplots import make_subplots
-import plotly.graph_objs as go
-from itertools import product
-import plotly.express as px
-from io import StringIO
-import seaborn as sns
+from merges import guarded_merge, spot_fill
+from panel import Panel, valid_rows
+from manifest import write_manifest
+from snapshot import write_snapshot, open_snapshot
 import pandas as pd
 import numpy as np
-import warnings
-import boto3
-import json
+import argparse
 import os
 
-# Check if viz directory exists
-if not os.path.isdir("viz"):
-    os.mkdir("viz")
+# Note: plotting and regression libraries (plotly, seaborn, statsmodels) are imported inside the functions
+# that use them, so listing figures or rendering one figure only pays for what that figure needs
 
-# Connect to public AWS S3 bucket
-# Hosted by NYU's Public Safety Lab @ https://psl-ccrb.s3.amazonaws.com/
-S3 = boto3.resource("s3")
+# Public AWS S3 bucket hosted by NYU's Public Safety Lab @ https://psl-ccrb.s3.amazonaws.com/
 BUCKET = "psl-ccrb"
-print(f"Connecting to NYU Public Safety Lab AWS S3 bucket {BUCKET}")
-conn = S3.Bucket(BUCKET)
 
-# Import NYU PSL NYC CCRB processed data, and separate substantiated complaints
-ccrb = pd.read_csv("s3://psl-ccrb/out/data.csv")
-ccrb["Num_NYPD_Officers_Year"] = np.where(ccrb["Year"]==2003, 36700, ccrb["Num_NYPD_Officers_Year"])
+# Local cache of memory-mapped snapshots of the processed data and flat panels (override with PSL_CCRB_CACHE)
+# Note: snapshots open without parsing, and their numeric columns are shared between processes through the page cache;
+# process.py refreshes data.snapshot whenever it rebuilds the processed data
+CACHE_DIR = os.environ.get("PSL_CCRB_CACHE", "cache")
+
+# Function to import NYU PSL NYC CCRB processed data, from the local snapshot when available
+def load_ccrb(refresh=False):
+    path = os.path.join(CACHE_DIR, "data.snapshot")
+    if refresh or not os.path.isfile(path):
+        print(f"Downloading processed data from s3://{BUCKET}/out/data.csv")
+        write_snapshot(pd.read_csv(f"s3://{BUCKET}/out/data.csv"), path)
+    ccrb = open_snapshot(path)
+    ccrb["Num_NYPD_Officers_Year"] = np.where(ccrb["Year"]==2003, 36700, ccrb["Num_NYPD_Officers_Year"])
+    return ccrb
 
 # Function to sum report crime column counts to produce per-metric reported crimes
 def sum_crimes(df):
@@ -43,28 +45,20 @@ def compile_precincts(dfa):
     # exclusion criteria
     dfa = dfa[(dfa["Year"] >= 2006) & (dfa["Year"] <= 2019) & (dfa["Precinct"] != "-1")]
     
-    # clean out Precinct 121 < 2014 (not yet an official precinct)
-    pct121 = dfa[dfa["Precinct"] == "121"]
-    pct121_del = pct121[pct121["Year"] < 2014] 
-    dfa = dfa[~dfa.isin(pct121_del)]
-    dfa = dfa[dfa["Year"].notna()]
+    # clean out precinct-years outside their declared validity (e.g. Precinct 121 < 2014, not yet an official precinct)
+    dfa = dfa[valid_rows(dfa)]
     
     # substantiated DataFrame
     dfs = dfa[dfa["Board Disposition"].str.contains("Substantiated ")]
     
-    # set up all combinations by precinct-year to fill missing later
-    precincts = list(set(dfa.Precinct.values))
-    years = list(set(dfa.Year.values))
-    blanks = pd.DataFrame(list(product(years, precincts)), columns=["Year", "Precinct"])
-    pct121 = blanks[blanks["Precinct"] == "121"]
-    pct121_del = pct121[pct121["Year"] < 2014] 
-    blanks = blanks[~blanks.isin(pct121_del)]
-    blanks = blanks[blanks["Year"].notna()]
+    # set up all valid precinct-years to fill missing later
+    panel = Panel(dfa["Precinct"].unique(), dfa["Year"].min(), dfa["Year"].max())
+    blanks = panel.keys()
     
     # collect number of reported crimes all types by precinct-year (spot fill missing TD11)
     cg = sum_crimes(dfa)
     td11_2017_crimes = {"Year": 2017, "Precinct": "TD11", "Crime Reports": 897.0}
-    cg = cg.append(td11_2017_crimes, ignore_index=True)
+    cg = spot_fill(cg, td11_2017_crimes, ["Year", "Precinct"])
     
     # collect arrests per precinct-year and per-precinct
     ayg = dfa.drop_duplicates(["Precinct", "Year", "Arrests_Precinct_Year"])[["Precinct", "Year", "Arrests_Precinct_Year"]]
@@ -84,51 +78,73 @@ def compile_precincts(dfa):
     demo_df = demo_df.loc[:,~demo_df.columns.duplicated()]
     
     # merge reported crimes, demographics into all precinct-year combinations
-    pyg = pd.merge(blanks, cg, how="left", on=["Precinct", "Year"])
-    pyg = pd.merge(pyg, demo_df, how="left", on="Precinct")
+    pyg = guarded_merge(blanks, cg, how="left", on=["Precinct", "Year"], validate="m:1")
+    pyg = guarded_merge(pyg, demo_df, how="left", on="Precinct", validate="m:1")
     
-    # collect all complaints, substantiated complaints per precinct-year
-    complaints = dfa.groupby(["Year", "Precinct"])["Unique Id"].count().reset_index()
-    substantiated = dfs.groupby(["Year", "Precinct"])["Unique Id"].count().reset_index()
-    
-    # merge in complaint counts per precinct-year
-    pyg = pd.merge(pyg, complaints, how="left", on=["Year", "Precinct"]).rename(columns={"Unique Id": "Complaints"})
-    pyg["Complaints"] = pyg["Complaints"].fillna(0.0)
-    pyg = pd.merge(pyg, substantiated, how="left", on=["Year", "Precinct"]).rename(columns={"Unique Id": "Substantiated"})
-    pyg["Substantiated"] = pyg["Substantiated"].fillna(0.0)
+    # collect all complaints, substantiated complaints per precinct-year (zero where none)
+    pyg["Complaints"] = panel.counts(dfa[dfa["Unique Id"].notna()])
+    pyg["Substantiated"] = panel.counts(dfs[dfs["Unique Id"].notna()])
     
     # collect means of relevant columns
-    pyg = pd.merge(pyg, pyg.groupby("Precinct")["Crime Reports"].mean().reset_index().rename(columns={"Crime Reports": "Annual_Mean_Crime_Reports"}), on="Precinct")
-    pyg = pd.merge(pyg, pyg.groupby("Precinct")["Complaints"].mean().reset_index().rename(columns={"Complaints": "Annual_Mean_Complaints"}), on="Precinct")
-    pyg = pd.merge(pyg, pyg.groupby("Precinct")["Substantiated"].mean().reset_index().rename(columns={"Substantiated": "Annual_Mean_Substantiated"}), on="Precinct")
-    pyg = pd.merge(pyg, ayg, how="left", on=["Year", "Precinct"])
-    pyg = pd.merge(pyg, syg, how="left", on=["Year", "Precinct"])
+    pyg = guarded_merge(pyg, pyg.groupby("Precinct")["Crime Reports"].mean().reset_index().rename(columns={"Crime Reports": "Annual_Mean_Crime_Reports"}), on="Precinct", validate="m:1")
+    pyg = guarded_merge(pyg, pyg.groupby("Precinct")["Complaints"].mean().reset_index().rename(columns={"Complaints": "Annual_Mean_Complaints"}), on="Precinct", validate="m:1")
+    pyg = guarded_merge(pyg, pyg.groupby("Precinct")["Substantiated"].mean().reset_index().rename(columns={"Substantiated": "Annual_Mean_Substantiated"}), on="Precinct", validate="m:1")
+    pyg = guarded_merge(pyg, ayg, how="left", on=["Year", "Precinct"], validate="m:1")
+    pyg = guarded_merge(pyg, syg, how="left", on=["Year", "Precinct"], validate="m:1")
     
-    # save precinct-year flat file to CSV on S3 and in out directory
-    pyg.to_csv("s3://psl-ccrb/out/data-flat-by-precinct-year.csv", index=False)
-    pyg.to_csv("out/data-flat-by-precinct-year.csv", index=False)
-
     # collect unique number of officers per precinct
     og = dfa.groupby("Precinct")["Unique Id"].nunique().reset_index().rename(columns={"Unique Id": "Officers"})
 
     # group by precinct and collect complaints/substantiated per officer
     pg = pyg.drop(["Year", "Crime Reports", "Complaints", "Substantiated", "Arrests_Precinct_Year", "Stops_Precinct_Year"], axis=1).drop_duplicates().sort_values(by="Precinct")
-    pg = pd.merge(pg, pyg.groupby("Precinct")["Complaints"].sum().reset_index(), on="Precinct")
-    pg = pd.merge(pg, pyg.groupby("Precinct")["Substantiated"].sum().reset_index(), on="Precinct")
-    pg = pd.merge(pg, og, how="left", on="Precinct")
+    pg = guarded_merge(pg, pyg.groupby("Precinct")["Complaints"].sum().reset_index(), on="Precinct", validate="1:1")
+    pg = guarded_merge(pg, pyg.groupby("Precinct")["Substantiated"].sum().reset_index(), on="Precinct", validate="1:1")
+    pg = guarded_merge(pg, og, how="left", on="Precinct", validate="1:1")
     pg["Mean_Complaints_per_Officer"] = pg["Complaints"]/pg["Officers"]
     pg["Mean_Substantiated_per_Officer"] = pg["Substantiated"]/pg["Officers"]
-    pg = pd.merge(pg, apg, how="left", on="Precinct")
-    pg = pd.merge(pg, spg, how="left", on="Precinct")
-    
-    # save precinct flat file to CSV on S3 and in out directory
-    pg.to_csv("s3://psl-ccrb/out/data-flat-by-precinct.csv", index=False)
-    pg.to_csv("out/data-flat-by-precinct.csv", index=False)
-
-    return pg
+    pg = guarded_merge(pg, apg, how="left", on="Precinct", validate="1:1")
+    pg = guarded_merge(pg, spg, how="left", on="Precinct", validate="1:1")
+
+    return pyg, pg
+
+# Function to flatten to means by precinct-year and precinct, reusing the local snapshots of a previous run
+# Note: the panels are rebuilt whenever the processed data snapshot is newer than they are
+def load_precincts(dfa, refresh=False):
+    source = os.path.join(CACHE_DIR, "data.snapshot")
+    paths = [os.path.join(CACHE_DIR, "flat-by-precinct-year.snapshot"), os.path.join(CACHE_DIR, "flat-by-precinct.snapshot")]
+    stale = not all(os.path.isfile(p) for p in paths) or (os.path.isfile(source) and os.path.getmtime(source) > min(os.path.getmtime(p) for p in paths))
+    if refresh or stale:
+        for panel, path in zip(compile_precincts(dfa), paths):
+            write_snapshot(panel, path)
+    return tuple(open_snapshot(p) for p in paths)
+
+# Function to save precinct-year and precinct flat files (with content-hash manifests) in a directory or S3 prefix
+def save_flat(pyg, pg, out="out"):
+    for df, name in [(pyg, "data-flat-by-precinct-year.csv"), (pg, "data-flat-by-precinct.csv")]:
+        df.to_csv(f"{out}/{name}", index=False)
+        write_manifest(df, f"{out}/{name}")
+
+# Function to upload precinct-year and precinct flat files to CSV on S3
+def upload_flat(pyg, pg):
+    save_flat(pyg, pg, f"s3://{BUCKET}/out")
+
+# Function to fit an OLS line y = b0 + b1 * x over rows where both are present (same fit as plotly's "ols" trendline)
+def fit_line(df, x, y):
+    df = df[[x, y]].dropna()
+    b1, b0 = np.polyfit(df[x], df[y], 1)
+    return b0, b1
+
+# Function to add per-precinct predictions from reported crimes and the 'excess' residuals over them
+def excess_residuals(df, complaints_coefs, substantiated_coefs, stops_coefs):
+    df = df.copy()
+    for col, (b0, b1) in [("Complaints", complaints_coefs), ("Substantiated", substantiated_coefs), ("Stops", stops_coefs)]:
+        df[f"Annual_Mean_{col}_Pred"] = b0 + b1 * df["Annual_Mean_Crime_Reports"]
+        df[f"Annual_Mean_Excess_{col}"] = df[f"Annual_Mean_{col}"] - df[f"Annual_Mean_{col}_Pred"]
+    return df
 
 # Function to generate confidence interval shape in seaborn to pass to plotly
 def seaborn_conf_int(df, x, y):
+    import seaborn as sns
     rg = sns.regplot(x=df[x], y=df[y])
     X = rg.get_lines()[0].get_xdata()
     Y = rg.get_lines()[0].get_ydata()
@@ -144,12 +160,14 @@ def seaborn_conf_int(df, x, y):
 
 # Function to generate Figure 1
 def annual_complaints(dfa, start, stop, figno, ign_pcts=[]):
+    from plotly.subplots import make_subplots
+    import plotly.graph_objs as go
     dfa = dfa[(dfa["Year"] >= start) & (dfa["Year"] <= stop)]
     dfa = dfa[~dfa["Precinct"].isin(ign_pcts)]
     dfs = dfa[dfa["Board Disposition"].str.contains("Substantiated ")]
     ga = dfa.groupby("Year")["Unique Id"].count().reset_index().rename(columns={"Unique Id": "All"})
     gb = dfs.groupby("Year")["Unique Id"].count().reset_index().rename(columns={"Unique Id": "Substantiated"})
-    g = pd.merge(ga, gb, on="Year")
+    g = guarded_merge(ga, gb, on="Year", validate="1:1")
 
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
@@ -177,16 +195,18 @@ def annual_complaints(dfa, start, stop, figno, ign_pcts=[]):
 
 # Function to generate Figure 2
 def annual_complaints_officers_crimes(dfa, start, stop, figno, ign_pcts=[]):
+    from plotly.subplots import make_subplots
+    import plotly.graph_objs as go
     dfa = dfa[(dfa["Year"] >= start) & (dfa["Year"] <= stop)]
     dfa = dfa[~dfa["Precinct"].isin(ign_pcts)]
     dfs = dfa[dfa["Board Disposition"].str.contains("Substantiated ")]
     ga = dfa.groupby("Year")["Unique Id"].count().reset_index().rename(columns={"Unique Id": "All"})
     gb = dfs.groupby("Year")["Unique Id"].count().reset_index().rename(columns={"Unique Id": "Substantiated"})
-    g = pd.merge(ga, gb, on="Year")
+    g = guarded_merge(ga, gb, on="Year", validate="1:1")
     og = dfa.drop_duplicates(["Year", "Num_NYPD_Officers_Year"])[["Year", "Num_NYPD_Officers_Year"]].sort_values(by="Year")
     cg = dfa.drop_duplicates(["Year", "Num_Offenses_Year"])[["Year", "Num_Offenses_Year"]].sort_values(by="Year")
-    g = pd.merge(g, og, on="Year")
-    g = pd.merge(g, cg, on="Year")
+    g = guarded_merge(g, og, on="Year", validate="1:1")
+    g = guarded_merge(g, cg, on="Year", validate="1:1")
     
     fig = make_subplots(rows=2, cols=2)
     fig.add_trace(
@@ -224,11 +244,12 @@ def annual_complaints_officers_crimes(dfa, start, stop, figno, ign_pcts=[]):
 
 # Function to generate Figure 3
 def annual_complaints_vs_officers_reg(dfa, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     dfa = dfa[(dfa["Year"] >= start) & (dfa["Year"] <= stop)]
     dfa = dfa[~dfa["Precinct"].isin(ign_pcts)]
     g = dfa.groupby("Year")["Unique Id"].count().reset_index().rename(columns={"Unique Id": "Complaints"})
     og = dfa.drop_duplicates(["Year", "Num_NYPD_Officers_Year"])[["Year", "Num_NYPD_Officers_Year"]].sort_values(by="Year")
-    g = pd.merge(g, og, on="Year")
+    g = guarded_merge(g, og, on="Year", validate="1:1")
     g = g.rename(columns={"Num_NYPD_Officers_Year": "NYPD Officers"})
     
     shapes = seaborn_conf_int(g, "NYPD Officers", "Complaints") 
@@ -250,12 +271,13 @@ def annual_complaints_vs_officers_reg(dfa, start, stop, figno, ign_pcts=[]):
 
 # Function to generate Figure A1
 def annual_subst_complaints_vs_officers_reg(dfa, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     dfa = dfa[(dfa["Year"] >= start) & (dfa["Year"] <= stop)]
     dfa = dfa[~dfa["Precinct"].isin(ign_pcts)]
     dfs = dfa[dfa["Board Disposition"].str.contains("Substantiated ")]
     g = dfs.groupby("Year")["Unique Id"].count().reset_index().rename(columns={"Unique Id": "Substantiated"})
     og = dfa.drop_duplicates(["Year", "Num_NYPD_Officers_Year"])[["Year", "Num_NYPD_Officers_Year"]].sort_values(by="Year")
-    g = pd.merge(g, og, on="Year")
+    g = guarded_merge(g, og, on="Year", validate="1:1")
     g = g.rename(columns={"Num_NYPD_Officers_Year": "NYPD Officers"})
 
     shapes = seaborn_conf_int(g, "NYPD Officers", "Substantiated") 
@@ -277,6 +299,7 @@ def annual_subst_complaints_vs_officers_reg(dfa, start, stop, figno, ign_pcts=[]
 
 # Function to generate Figure 4
 def annual_complaints_vs_reported_crime_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.rename(columns={"Annual_Mean_Crime_Reports": "Mean Annual Reported Crimes", "Annual_Mean_Complaints": "Mean Annual Misconduct Complaints"})
     
     shapes = seaborn_conf_int(df, "Mean Annual Reported Crimes", "Mean Annual Misconduct Complaints") 
@@ -294,12 +317,11 @@ def annual_complaints_vs_reported_crime_reg(df, start, stop, figno, ign_pcts=[])
     fig.show()
     
     results = px.get_trendline_results(fig)
-    global cb0, cb1
-    cb0, cb1 = results.px_fit_results.iloc[0].params
     return df, results.px_fit_results.iloc[0].summary()
 
 # Function to generate Figure A2
 def annual_subst_complaints_vs_reported_crime_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.rename(columns={"Annual_Mean_Crime_Reports": "Mean Annual Reported Crimes", "Annual_Mean_Substantiated": "Mean Annual Substantiated Misconduct Complaints"})
     
     shapes = seaborn_conf_int(df, "Mean Annual Reported Crimes", "Mean Annual Substantiated Misconduct Complaints") 
@@ -317,12 +339,11 @@ def annual_subst_complaints_vs_reported_crime_reg(df, start, stop, figno, ign_pc
     fig.show()
     
     results = px.get_trendline_results(fig)
-    global cb0s, cb1s
-    cb0s, cb1s = results.px_fit_results.iloc[0].params
     return df, results.px_fit_results.iloc[0].summary()
 
 # Function to generate Figure 5
 def annual_stops_vs_reported_crime_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.rename(columns={"Annual_Mean_Crime_Reports": "Mean Annual Reported Crimes", "Annual_Mean_Stops": "Mean Annual Stops"})
     
     shapes = seaborn_conf_int(df, "Mean Annual Reported Crimes", "Mean Annual Stops") 
@@ -340,20 +361,16 @@ def annual_stops_vs_reported_crime_reg(df, start, stop, figno, ign_pcts=[]):
     fig.show()
     
     results = px.get_trendline_results(fig)
-    global sb0, sb1
-    sb0, sb1 = results.px_fit_results.iloc[0].params
     return df, results.px_fit_results.iloc[0].summary()
 
 # Function to generate Figure 6
 def annual_complaints_vs_stops_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df["Annual_Mean_Stops"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
     df = df.rename(columns={"Annual_Mean_Stops": "Mean Annual Stops", "Annual_Mean_Complaints": "Mean Annual Misconduct Complaints"})
-    df["Annual_Mean_Complaints_Pred"] = cb0 + cb1 * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Complaints"] = df["Mean Annual Misconduct Complaints"] - df["Annual_Mean_Complaints_Pred"]
-    df["Annual_Mean_Stops_Pred"] = sb0 + sb1 * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Stops"] = df["Mean Annual Stops"] - df["Annual_Mean_Stops_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Complaints": "Mean Annual 'Excess' Complaints", "Annual_Mean_Excess_Stops": "Mean Annual 'Excess' Stops"})
     
     shapes = seaborn_conf_int(df, "Mean Annual 'Excess' Stops", "Mean Annual 'Excess' Complaints") 
     fig = px.scatter(df, x=df["Mean Annual 'Excess' Stops"], y=df["Mean Annual 'Excess' Complaints"], color=df.Precinct, text=df.Precinct, trendline="ols")
@@ -374,14 +391,12 @@ def annual_complaints_vs_stops_reg(df, start, stop, figno, ign_pcts=[]):
 
 # Function to generate Figure A3
 def annual_subst_complaints_vs_stops_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df["Annual_Mean_Stops"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
     df = df.rename(columns={"Annual_Mean_Stops": "Mean Annual Stops", "Annual_Mean_Substantiated": "Mean Annual Substantiated Misconduct Complaints"})
-    df["Annual_Mean_Substantiated_Complaints_Pred"] = cb0s + cb1s * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Substantiated Complaints"] = df["Mean Annual Substantiated Misconduct Complaints"] - df["Annual_Mean_Substantiated_Complaints_Pred"]
-    df["Annual_Mean_Stops_Pred"] = sb0 + sb1 * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Stops"] = df["Mean Annual Stops"] - df["Annual_Mean_Stops_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Substantiated": "Mean Annual 'Excess' Substantiated Complaints", "Annual_Mean_Excess_Stops": "Mean Annual 'Excess' Stops"})
     
     shapes = seaborn_conf_int(df, "Mean Annual 'Excess' Stops", "Mean Annual 'Excess' Substantiated Complaints") 
     fig = px.scatter(df, x=df["Mean Annual 'Excess' Stops"], y=df["Mean Annual 'Excess' Substantiated Complaints"], color=df.Precinct, text=df.Precinct, trendline="ols")
@@ -402,10 +417,10 @@ def annual_subst_complaints_vs_stops_reg(df, start, stop, figno, ign_pcts=[]):
 
 # Function to generate Figure 7
 def annual_complaints_vs_complaints_per_officer_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df.rename(columns={f"Mean_Complaints_per_Officer": "Mean Complaints Per Accused Officer", "Annual_Mean_Complaints": "Mean Annual Misconduct Complaints"})
-    df["Annual_Mean_Complaints_Pred"] = cb0 + cb1 * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Complaints"] = df["Mean Annual Misconduct Complaints"] - df["Annual_Mean_Complaints_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Complaints": "Mean Annual 'Excess' Complaints"})
     
     shapes = seaborn_conf_int(df, f"Mean Complaints Per Accused Officer", "Mean Annual 'Excess' Complaints") 
     fig = px.scatter(df, x=df[f"Mean Complaints Per Accused Officer"], y=df["Mean Annual 'Excess' Complaints"], text=df.Precinct, trendline="ols")
@@ -426,10 +441,10 @@ def annual_complaints_vs_complaints_per_officer_reg(df, start, stop, figno, ign_
 
 # Function to generate Figure A4
 def annual_subst_complaints_vs_complaints_per_officer_reg(df, start, stop, figno, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df.rename(columns={f"Mean_Substantiated_per_Officer": "Mean Substantiated Complaints Per Accused Officer", "Annual_Mean_Substantiated": "Mean Annual Substantiated Misconduct Complaints"})
-    df["Annual_Mean_Substantiated_Pred"] = cb0s + cb1s * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Substantiated Complaints"] = df["Mean Annual Substantiated Misconduct Complaints"] - df["Annual_Mean_Substantiated_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Substantiated": "Mean Annual 'Excess' Substantiated Complaints"})
     
     shapes = seaborn_conf_int(df, f"Mean Substantiated Complaints Per Accused Officer", "Mean Annual 'Excess' Substantiated Complaints") 
     fig = px.scatter(df, x=df[f"Mean Substantiated Complaints Per Accused Officer"], y=df["Mean Annual 'Excess' Substantiated Complaints"], text=df.Precinct, trendline="ols")
@@ -450,12 +465,12 @@ def annual_subst_complaints_vs_complaints_per_officer_reg(df, start, stop, figno
 
 # Function to generate Figures 8, A7, A8
 def annual_complaints_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df[f"2010_Percent_{demo}_Residents"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
     df = df.rename(columns={f"2010_Percent_{demo}_Residents": f"2010 Percent {demo} Residents", "Annual_Mean_Complaints": "Mean Annual Misconduct Complaints"})
-    df["Annual_Mean_Complaints_Pred"] = cb0 + cb1 * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Complaints"] = df["Mean Annual Misconduct Complaints"] - df["Annual_Mean_Complaints_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Complaints": "Mean Annual 'Excess' Complaints"})
     
     shapes = seaborn_conf_int(df, f"2010 Percent {demo} Residents", "Mean Annual 'Excess' Complaints") 
     fig = px.scatter(df, x=df[f"2010 Percent {demo} Residents"], y=df["Mean Annual 'Excess' Complaints"], color=df.Precinct, text=df.Precinct, trendline="ols")
@@ -476,12 +491,12 @@ def annual_complaints_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]
 
 # Function to generate Figures A5, A9, A10
 def annual_subst_complaints_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df[f"2010_Percent_{demo}_Residents"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
     df = df.rename(columns={f"2010_Percent_{demo}_Residents": f"2010 Percent {demo} Residents", "Annual_Mean_Substantiated": "Mean Annual Substantiated Misconduct Complaints"})
-    df["Annual_Mean_Substantiated_Pred"] = cb0s + cb1s * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Substantiated Complaints"] = df["Mean Annual Substantiated Misconduct Complaints"] - df["Annual_Mean_Substantiated_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Substantiated": "Mean Annual 'Excess' Substantiated Complaints"})
     
     shapes = seaborn_conf_int(df, f"2010 Percent {demo} Residents", "Mean Annual 'Excess' Substantiated Complaints") 
     fig = px.scatter(df, x=df[f"2010 Percent {demo} Residents"], y=df["Mean Annual 'Excess' Substantiated Complaints"], color=df.Precinct, text=df.Precinct, trendline="ols")
@@ -502,12 +517,12 @@ def annual_subst_complaints_vs_prop_demo_reg(df, start, stop, figno, demo, ign_p
 
 # Function to generate Figure 9
 def annual_stops_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df["Annual_Mean_Stops"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
     df = df.rename(columns={"Annual_Mean_Stops": "Mean Annual Stops", f"2010_Percent_{demo}_Residents": f"2010 Percent {demo} Residents"})
-    df["Annual_Mean_Stops_Pred"] = sb0 + sb1 * df["Annual_Mean_Crime_Reports"]
-    df["Mean Annual 'Excess' Stops"] = df["Mean Annual Stops"] - df["Annual_Mean_Stops_Pred"]
+    df = df.rename(columns={"Annual_Mean_Excess_Stops": "Mean Annual 'Excess' Stops"})
     
     shapes = seaborn_conf_int(df, f"2010 Percent {demo} Residents", "Mean Annual 'Excess' Stops") 
     fig = px.scatter(df, x=df[f"2010 Percent {demo} Residents"], y=df["Mean Annual 'Excess' Stops"], color=df.Precinct, text=df.Precinct, trendline="ols")
@@ -528,6 +543,7 @@ def annual_stops_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]):
 
 # Function to generate Figure 10
 def annual_complaints_per_officer_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df[f"2010_Percent_{demo}_Residents"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
@@ -551,6 +567,7 @@ def annual_complaints_per_officer_vs_prop_demo_reg(df, start, stop, figno, demo,
 
 # Function to generate Figure A6
 def annual_subst_complaints_per_officer_vs_prop_demo_reg(df, start, stop, figno, demo, ign_pcts=[]):
+    import plotly.express as px
     df = df.copy()
     df = df[df[f"2010_Percent_{demo}_Residents"].notna()]
     df["Precinct"] = df["Precinct"].astype(int)
@@ -572,48 +589,119 @@ def annual_subst_complaints_per_officer_vs_prop_demo_reg(df, start, stop, figno,
     results = px.get_trendline_results(fig)
     return df, results.px_fit_results.iloc[0].summary()
 
-# Generate visualizations
-print("Generating Fig 1")
-annual_complaints(ccrb, 1986, 2019, "1")
-print("Generating Fig 2")
-annual_complaints_officers_crimes(ccrb, 1986, 2019, "2")
-print("Generating Fig 3")
-annual_complaints_vs_officers_reg(ccrb, 1986, 2018, "3")
-print("Generating Fig A1")
-annual_subst_complaints_vs_officers_reg(ccrb, 1986, 2018, "a1")
-
-print("Flattening precinct-year data")
-flat = compile_precincts(ccrb)
-
-print("Generating Fig 4")
-annual_complaints_vs_reported_crime_reg(flat, 2006, 2019, "4")
-print("Generating Fig A2")
-annual_subst_complaints_vs_reported_crime_reg(flat, 2006, 2019, "a2")
-print("Generating Fig 5")
-annual_stops_vs_reported_crime_reg(flat, 2006, 2019, "5")
-print("Generating Fig 6")
-annual_complaints_vs_stops_reg(flat, 2006, 2019, "6")
-print("Generating Fig A3")
-annual_subst_complaints_vs_stops_reg(flat, 2006, 2019, "a3")
-print("Generating Figure 7")
-annual_complaints_vs_complaints_per_officer_reg(flat, 2006, 2019, "7")
-print("Generating Figure A4")
-annual_subst_complaints_vs_complaints_per_officer_reg(flat, 2006, 2019, "a4")
-print("Generating Fig 8")
-annual_complaints_vs_prop_demo_reg(flat, 2006, 2019, "8", "Black")
-print("Generating Figure A5")
-annual_subst_complaints_vs_prop_demo_reg(flat, 2006, 2019, "a5", "Black")
-print("Generating Fig 9")
-annual_stops_vs_prop_demo_reg(flat, 2006, 2019, "9", "Black")
-print("Generating Figure 10")
-annual_complaints_per_officer_vs_prop_demo_reg(flat, 2006, 2019, "10", "Black")
-print("Generating Figure A6")
-annual_subst_complaints_per_officer_vs_prop_demo_reg(flat, 2006, 2019, "a6", "Black")
-print("Generating Fig A7")
-annual_complaints_vs_prop_demo_reg(flat, 2006, 2019, "a7", "Non-Hispanic White")
-print("Generating Fig A8")
-annual_complaints_vs_prop_demo_reg(flat, 2006, 2019, "a8", "Non-Hispanic Asian")
-print("Generating Figure A9")
-annual_subst_complaints_vs_prop_demo_reg(flat, 2006, 2019, "a9", "Non-Hispanic White")
-print("Generating Figure A10")
-annual_subst_complaints_vs_prop_demo_reg(flat, 2006, 2019, "a10", "Non-Hispanic Asian")
+# Registry of report figures: figure number -> (title, function, input node, start year, stop year, extra arguments)
+# Note: "ccrb" figures use the processed data, "flat" figures the compile_precincts output and
+# "excess" figures the flat data with 'excess' residuals over the reported-crime regressions
+FIGURES = {
+    "1": ("Complaints vs. substantiated complaints", annual_complaints, "ccrb", 1986, 2019, ()),
+    "2": ("Complaints, substantiated complaints, officers & reported crimes", annual_complaints_officers_crimes, "ccrb", 1986, 2019, ()),
+    "3": ("Complaints vs. sworn officers", annual_complaints_vs_officers_reg, "ccrb", 1986, 2018, ()),
+    "a1": ("Substantiated complaints vs. sworn officers", annual_subst_complaints_vs_officers_reg, "ccrb", 1986, 2018, ()),
+    "4": ("Per-precinct complaints vs. reported crimes", annual_complaints_vs_reported_crime_reg, "flat", 2006, 2019, ()),
+    "a2": ("Per-precinct substantiated complaints vs. reported crimes", annual_subst_complaints_vs_reported_crime_reg, "flat", 2006, 2019, ()),
+    "5": ("Per-precinct stops vs. reported crimes", annual_stops_vs_reported_crime_reg, "flat", 2006, 2019, ()),
+    "6": ("Per-precinct 'excess' complaints vs. 'excess' stops", annual_complaints_vs_stops_reg, "excess", 2006, 2019, ()),
+    "a3": ("Per-precinct 'excess' substantiated complaints vs. 'excess' stops", annual_subst_complaints_vs_stops_reg, "excess", 2006, 2019, ()),
+    "7": ("Per-precinct 'excess' complaints vs. complaints per accused officer", annual_complaints_vs_complaints_per_officer_reg, "excess", 2006, 2019, ()),
+    "a4": ("Per-precinct 'excess' substantiated complaints vs. substantiated complaints per accused officer", annual_subst_complaints_vs_complaints_per_officer_reg, "excess", 2006, 2019, ()),
+    "8": ("Per-precinct 'excess' complaints vs. percent Black residents", annual_complaints_vs_prop_demo_reg, "excess", 2006, 2019, ("Black",)),
+    "a5": ("Per-precinct 'excess' substantiated complaints vs. percent Black residents", annual_subst_complaints_vs_prop_demo_reg, "excess", 2006, 2019, ("Black",)),
+    "9": ("Per-precinct 'excess' stops vs. percent Black residents", annual_stops_vs_prop_demo_reg, "excess", 2006, 2019, ("Black",)),
+    "10": ("Per-precinct complaints per accused officer vs. percent Black residents", annual_complaints_per_officer_vs_prop_demo_reg, "flat", 2006, 2019, ("Black",)),
+    "a6": ("Per-precinct substantiated complaints per accused officer vs. percent Black residents", annual_subst_complaints_per_officer_vs_prop_demo_reg, "flat", 2006, 2019, ("Black",)),
+    "a7": ("Per-precinct 'excess' complaints vs. percent non-Hispanic White residents", annual_complaints_vs_prop_demo_reg, "excess", 2006, 2019, ("Non-Hispanic White",)),
+    "a8": ("Per-precinct 'excess' complaints vs. percent non-Hispanic Asian residents", annual_complaints_vs_prop_demo_reg, "excess", 2006, 2019, ("Non-Hispanic Asian",)),
+    "a9": ("Per-precinct 'excess' substantiated complaints vs. percent non-Hispanic White residents", annual_subst_complaints_vs_prop_demo_reg, "excess", 2006, 2019, ("Non-Hispanic White",)),
+    "a10": ("Per-precinct 'excess' substantiated complaints vs. percent non-Hispanic Asian residents", annual_subst_complaints_vs_prop_demo_reg, "excess", 2006, 2019, ("Non-Hispanic Asian",)),
+}
+
+# Function to generate one registered figure from its input data
+def render_figure(figno, df):
+    title, func, source, start, stop, extra = FIGURES[figno]
+    print(f"Generating Fig {figno.upper()}")
+    return func(df, start, stop, figno, *extra)
+
+# Function to declare the graph of intermediate products and figures: node -> (dependencies, function of their values)
+# Note: the save/upload nodes write out/ and S3 and are only run when requested explicitly
+def build_graph(refresh=False):
+    graph = {
+        "ccrb": ((), lambda: load_ccrb(refresh)),
+        "flat-panels": (("ccrb",), lambda ccrb: load_precincts(ccrb, refresh)),
+        "flat-by-precinct-year": (("flat-panels",), lambda panels: panels[0]),
+        "flat": (("flat-panels",), lambda panels: panels[1]),
+        "coef-complaints": (("flat",), lambda flat: fit_line(flat, "Annual_Mean_Crime_Reports", "Annual_Mean_Complaints")),
+        "coef-substantiated": (("flat",), lambda flat: fit_line(flat, "Annual_Mean_Crime_Reports", "Annual_Mean_Substantiated")),
+        "coef-stops": (("flat",), lambda flat: fit_line(flat, "Annual_Mean_Crime_Reports", "Annual_Mean_Stops")),
+        "excess": (("flat", "coef-complaints", "coef-substantiated", "coef-stops"), excess_residuals),
+        "save-flat": (("flat-panels",), lambda panels: save_flat(*panels)),
+        "upload-flat": (("flat-panels",), lambda panels: upload_flat(*panels)),
+    }
+    for figno, (title, func, source, start, stop, extra) in FIGURES.items():
+        graph[f"fig-{figno}"] = ((source,), lambda df, figno=figno: render_figure(figno, df))
+    return graph
+
+# Class to run graph nodes in dependency order, computing each node at most once
+class Scheduler:
+    def __init__(self, graph, results=None):
+        self.graph = graph
+        self.results = dict(results or {})
+
+    # topological order of the nodes needed for targets (depth-first, dependencies before dependents)
+    # Note: nodes already materialised (or seeded through results) are not walked, so their upstream is skipped
+    def order(self, targets):
+        order, state = [], {}
+        def visit(node):
+            if state.get(node) == "done" or node in self.results:
+                return
+            if state.get(node) == "visiting":
+                raise ValueError(f"Dependency cycle through {node}")
+            if node not in self.graph:
+                raise KeyError(f"Unknown node {node}")
+            state[node] = "visiting"
+            for dep in self.graph[node][0]:
+                visit(dep)
+            state[node] = "done"
+            order.append(node)
+        for target in targets:
+            visit(target)
+        return order
+
+    # compute targets, reusing any node already materialised in this scheduler
+    def run(self, targets):
+        for node in self.order(targets):
+            if node not in self.results:
+                deps, func = self.graph[node]
+                self.results[node] = func(*[self.results[d] for d in deps])
+        return [self.results[t] for t in targets]
+
+# Command line entry point, e.g. `python visualize.py fig 6`, `python visualize.py list`
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="visualize", description="Generate figures from the NYPD Officer Misconduct Analysis report")
+    parser.add_argument("--refresh", action="store_true", help="re-download the processed data and rebuild the flat panels instead of using the local snapshots")
+    parser.add_argument("--save", action="store_true", help="write the flat precinct files to out/")
+    parser.add_argument("--upload", action="store_true", help="upload the flat precinct files to S3")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list available figures")
+    fig = commands.add_parser("fig", help="generate one or more figures")
+    fig.add_argument("fignos", nargs="+", type=str.lower, metavar="FIGURE", help="figure number, e.g. 6 or a2")
+    commands.add_parser("all", help="generate every figure")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for figno, (title, func, source, start, stop, extra) in FIGURES.items():
+            print(f"{figno.upper():>4}  {title} ({start}-{stop})")
+        return
+
+    fignos = list(FIGURES) if args.command == "all" else args.fignos
+    unknown = [f for f in fignos if f not in FIGURES]
+    if unknown:
+        parser.error(f"unknown figure(s) {', '.join(unknown)}; see `visualize list`")
+    targets = [f"fig-{f}" for f in fignos]
+    if args.save:
+        targets.append("save-flat")
+    if args.upload:
+        targets.append("upload-flat")
+    Scheduler(build_graph(args.refresh)).run(targets)
+
+if __name__ == "__main__":
+    main()